@@ -2,18 +2,32 @@
 Author: Amol Gaikwad
 
 This program implements clustering using Otsu's method. It plots the input data against random noise. Then it performs
-Parzen density estimation.
+Parzen density estimation. With --stream the files are read in chunks into log spaced histograms, one worker per
+file, and the clusters are found from the merged histogram with memory independent of the number of rows.
 
 """
 __author__ = 'Amol Gaikwad'
 
 import sys
-import csv
 import math
 import numpy as np
 import warnings
-import random
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as mplot
+from HW_Gaikwad_Amol_Otsu import multi_otsu, new_histogram, add_to_histogram, merge_histograms, \
+    histogram_multi_otsu, split_histogram
+from HW_Gaikwad_Amol_Kde import kde
+from HW_Gaikwad_Amol_Mixture import gaussian_mixture, soft_assign, component_moments
+
+# Shortest stop duration kept in seconds
+MIN_DURATION = 0.5
+# Number of csv rows parsed at a time when streaming
+CHUNK_ROWS = 65536
+# Upper edge of the streaming histogram in seconds, longer durations go to its last bin
+HIST_MAX_DURATION = 1e6
+# Default number of clusters
+CLUSTERS = 4
 
 def main():
     """
@@ -22,44 +36,47 @@ def main():
 
         :param : Command line arguments
         :argv[1]: CSV file to be loaded
+        :argv[2]: Optional number of clusters
+        :--stream: Stream one or more CSV files through histograms instead, optionally followed by the number of
+                   clusters
+        :--mixture: Also fit a Gaussian mixture with one component per cluster
+        :--lognormal: Also fit a log-normal mixture with one component per cluster
 
         :return: None
     """
     warnings.filterwarnings("ignore")
+    args = [arg for arg in sys.argv if arg not in ("--stream", "--mixture", "--lognormal")]
+    # Optional trailing number of clusters
+    clusters = int(args.pop()) if len(args) >= 3 and args[-1].isdigit() else CLUSTERS
     # Read number of arguments
-    noofargs = len(sys.argv)
+    noofargs = len(args)
 
     # Check for invalid number of arguments
-    if (noofargs != 2):
+    if "--stream" in sys.argv and noofargs >= 2:
+        stream_clusters(args[1:], clusters)
+    elif (noofargs != 2):
         print("Invalid number of arguments")
     else:
-        file = sys.argv[1]
+        file = args[1]
 
         # Preprocess the input file to remove durations less than 0.5 seconds
         data = preprocess(file)
         # Print the total data points after cleaning
         print("Total number of data points "+str(len(data))+"\n")
 
-        # Calculate otsu's threshold for cluster1
-        otsu_threshold = otsu(data)
-        # Make clusters based on otsu's threshold
-        clusterbig1, clustersmall1 = make_cluster(data, otsu_threshold)
-
-        # Calculate otsu's threshold for cluster2
-        otsu_threshold2 = otsu(clusterbig1)
-        # Make clusters based on otsu's threshold
-        clusterbig2, clustersmall2 = make_cluster(clusterbig1, otsu_threshold2)
-
-        # Calculate otsu's threshold for cluster3
-        otsu_threshold3 = otsu(clusterbig2)
-        # Make clusters based on otsu's threshold
-        clusterbig3, clustersmall3 = make_cluster(clusterbig2, otsu_threshold3)
+        # Calculate the optimal thresholds of all clusters at once
+        thresholds = multi_otsu(data, clusters)
+        # Summarize the clusters based on the thresholds in one pass
+        summaries = cluster_summaries(data, thresholds)
 
         # Display cluster properties sorted by average duration
-        show_cluster_features(clusterbig3, 0.5)
-        show_cluster_features(clustersmall3, otsu_threshold3)
-        show_cluster_features(clustersmall2, otsu_threshold2)
-        show_cluster_features(clustersmall1, otsu_threshold)
+        for cluster, threshold in enumerate([MIN_DURATION] + thresholds):
+            show_cluster_features(summaries, cluster, threshold)
+
+        # Soft clustering with a mixture started from the same thresholds
+        if "--mixture" in sys.argv or "--lognormal" in sys.argv:
+            model = gaussian_mixture(data, clusters, "--lognormal" in sys.argv)
+            show_mixture(model, data)
 
         # Plot input data against random noise
         plotdata(data)
@@ -67,47 +84,35 @@ def main():
         # Plot parzen density estimate
         parzenestimate(data)
 
-def parzenestimate(data):
+def parzenestimate(data, bandwidth="silverman", kernel="gaussian"):
     """
        Displays the parzen density estimate
 
        :param :
         data: Input data to be plotted
+        bandwidth: Kernel standard deviation in secs, or "silverman" or "scott"
+        kernel: One of the kernels of HW_Gaikwad_Amol_Kde
 
        :return:
-        None
+        grid: Stop durations at which the density is estimated
+        density: Estimated density at every grid point
     """
-    # Dictionary to store frequency count of data points
-    freq_count={}
-    # list of x-data points
-    x_data = []
-    # list of y-data points
-    y_data = []
-    # add data point to dictionary
-    for point in data:
-        # take ceil of data point
-        ceilpoint = math.ceil(float(point))
-        # increase frequency count by 1
-        freq_count[ceilpoint] = freq_count.get(ceilpoint,0)+1
-
-    # sort dictionary items
-    sorted_freq_count = sorted(freq_count.items())
-    # populate x and y data points
-    for key, val in sorted_freq_count:
-        x_data.append(key)
-        y_data.append(val)
-
-    # Plot duration in seconds vs frequency count
-    mplot.plot(x_data, y_data)
+    # Estimate the density on a regular grid
+    grid, density = kde(data, bandwidth, kernel)
+
+    # Plot duration in seconds vs density
+    mplot.plot(grid, density)
     # Set plot title
-    mplot.title("Parzen density estimation")
+    mplot.title("Parzen density estimation, " + kernel + " kernel")
     # Set plot x-axis label
     mplot.xlabel("Stop duration in secs")
     # Set plot y-axis label
-    mplot.ylabel("Counts per duration")
+    mplot.ylabel("Density per sec")
 
     mplot.show()
 
+    return grid, density
+
 def plotdata(data):
     """
        Displays the plot for input data vs random noise
@@ -118,14 +123,12 @@ def plotdata(data):
        :return:
         None
     """
-    # Get input data in float format
-    numdata = [float(point) for point in data]
     # Get random data
-    x = [random.uniform(0, 1) for count in range(0, len(numdata))]
+    x = np.random.uniform(0, 1, len(data))
 
     mplot.figure(figsize=[20, 10])
     # Plot input data vs random data
-    mplot.plot(numdata, x, 'o')
+    mplot.plot(data, x, 'o')
     # Set plot title
     mplot.title("Stop duration in seconds VS Random noise")
     # Set plot x-axis label
@@ -136,126 +139,238 @@ def plotdata(data):
     mplot.show()
 
 
-def make_cluster(data, threshold):
+def new_summaries(clusters):
     """
-       Makes two clusters from input data. One having all data points above threshold and other having all data
-       points less than equal to threshold
+       Empty running statistics of clusters
 
        :param :
-        data: Input data containing stopped durations
-        threshold: Threshold value used for making clusters
+        clusters: Number of clusters
 
        :return:
-        biggercluster: Cluster with bigger size
-        smallercluster: Cluster with smaller size
+        summaries: dictionary of per cluster count, mean, sum of squared deviations, minimum and maximum
     """
-    # Make cluster of data points less than equal to threshold
-    cluster_lower = [point for point in data if float(point) <= float(threshold)]
-    # Make cluster of data points greater than threshold
-    cluster_upper = [point for point in data if float(point) > float(threshold)]
-
-    # Find out bigger and smaller clusters
-    if len(cluster_lower) >= len(cluster_upper):
-        biggercluster = cluster_lower
-        smallercluster = cluster_upper
-    else:
-        biggercluster = cluster_upper
-        smallercluster = cluster_lower
+    return {"count": np.zeros(clusters), "mean": np.zeros(clusters), "m2": np.zeros(clusters),
+            "minimum": np.full(clusters, np.inf), "maximum": np.full(clusters, -np.inf)}
+
+def merge_summaries(first, second):
+    """
+       Combine running statistics of the same clusters over two parts of the data, using the parallel form of
+       Welford's update
+
+       :param :
+        first: Statistics of the first part
+        second: Statistics of the second part
+
+       :return:
+        summaries: Statistics of both parts
+    """
+    count = first["count"] + second["count"]
+    delta = second["mean"] - first["mean"]
+    # Share of the second part, 0 for clusters still empty
+    share = np.divide(second["count"], count, out=np.zeros_like(count), where=count > 0)
+
+    return {"count": count, "mean": first["mean"] + delta * share,
+            "m2": first["m2"] + second["m2"] + delta * delta * first["count"] * share,
+            "minimum": np.minimum(first["minimum"], second["minimum"]),
+            "maximum": np.maximum(first["maximum"], second["maximum"])}
+
+def summarize_chunk(values, thresholds):
+    """
+       Statistics of the clusters of one chunk of data
+
+       :param :
+        values: float64 array of durations
+        thresholds: Increasing threshold values, cluster c holds the durations greater than threshold c - 1 and
+                    less than equal to threshold c
+
+       :return:
+        summaries: Statistics of the clusters within the chunk
+    """
+    clusters = len(thresholds) + 1
+    # Cluster number of every data point
+    cluster_of = np.searchsorted(np.asarray(thresholds, dtype=np.float64), values, side="left")
+
+    summary = new_summaries(clusters)
+    summary["count"] = np.bincount(cluster_of, minlength=clusters).astype(np.float64)
+    found = summary["count"] > 0
+    summary["mean"][found] = np.bincount(cluster_of, weights=values, minlength=clusters)[found] / \
+        summary["count"][found]
+    deviation = values - summary["mean"][cluster_of]
+    summary["m2"] = np.bincount(cluster_of, weights=deviation * deviation, minlength=clusters)
+    np.minimum.at(summary["minimum"], cluster_of, values)
+    np.maximum.at(summary["maximum"], cluster_of, values)
+
+    return summary
+
+def cluster_summaries(data, thresholds, chunk_rows=CHUNK_ROWS):
+    """
+       Statistics of every cluster in a single pass over the data, a chunk at a time
+
+       :param :
+        data: float64 array of durations
+        thresholds: Increasing threshold values used for making clusters
+        chunk_rows: Number of durations summarized at a time
 
-    # Return bigger and smaller clusters
-    return biggercluster, smallercluster
+       :return:
+        summaries: Statistics of the clusters in increasing order of duration
+    """
+    summaries = new_summaries(len(thresholds) + 1)
+    for start in range(0, len(data), chunk_rows):
+        summaries = merge_summaries(summaries, summarize_chunk(data[start:start+chunk_rows], thresholds))
+
+    return summaries
 
-def show_cluster_features(cluster, threshold):
+def show_cluster_features(summaries, cluster, threshold):
     """
         Displays all properties of a cluster
 
        :param :
-        cluster: Cluster whose properties are to be displayed
+        summaries: Statistics of all clusters
+        cluster: Number of the cluster whose properties are to be displayed
         threshold: Threshold value used for the cluster
 
        :return:
         None
     """
     # calculate size of cluster
-    size = len(cluster)
-    # calculate sum of points in cluster
-    total = sum([float(point) for point in cluster])
-    # calculate average of points
-    avg = total / size
+    size = int(summaries["count"][cluster])
     # Print cluster properties
     print("***** Cluster *******")
     print("Cluster size "+ str(size))
-    print("Average duration value "+ str(avg))
-    print("Standard deviation is " + str(np.std([float(point) for point in cluster])))
-    print("Minimum duration value " + str(min([float(point) for point in cluster])))
-    print("Maximum duration value " + str(max([float(point) for point in cluster])))
+    print("Average duration value "+ str(summaries["mean"][cluster]))
+    print("Standard deviation is " + str(math.sqrt(summaries["m2"][cluster] / size)))
+    print("Minimum duration value " + str(summaries["minimum"][cluster]))
+    print("Maximum duration value " + str(summaries["maximum"][cluster]))
     print("Threshold duration value " + str(threshold))
     print("***** End of cluster *******\n")
 
 
-def otsu(data):
+def show_mixture(model, data):
     """
-       Implement Otsu's method to separate data into clusters
+        Displays all components of a mixture
 
        :param :
-        data: Input data from which clusters are to be formed
+        model: Mixture from gaussian_mixture
+        data: Input data the mixture was fitted to
 
        :return:
-        best_threshold: Returns the best threshold value using which clusters can be split
-
+        None
     """
-    # set the best mix varaiance and best threshold to infinity
-    best_mix_variance = math.inf
-    best_threshold = math.inf
-
-    for threshold in data:
-        # Get data points less than equal to threshold
-        wt_under = [float(point) for point in data if float(point) <= float(threshold)]
-        # Get data points greater than threshold
-        wt_over = [float(point) for point in data if float(point) > float(threshold)]
-        # calculate weight under fraction
-        wt_under_fraction = len(wt_under) / len(data)
-        # calculate weight over fraction
-        wt_over_fraction = len(wt_over) / len(data)
-
-        # calculate variance under
-        variance_under = np.var(wt_under)
-        # calculate variance over
-        variance_over = np.var(wt_over)
-        # calculate mix variance
-        mix_variance = wt_under_fraction * variance_under + wt_over_fraction * variance_over
-
-        # Set best mix variance and best threshold
-        if mix_variance < best_mix_variance:
-            best_mix_variance = mix_variance
-            best_threshold = threshold
-
-    return best_threshold
-
-def preprocess(file):
+    means, stds = component_moments(model)
+    # Number of data points most likely drawn from each component
+    likely = np.bincount(soft_assign(model, data).argmax(axis=1), minlength=len(means))
+    for component in np.argsort(means):
+        print("***** Mixture component *******")
+        print("Weight " + str(model["weights"][component]))
+        print("Expected size " + str(model["weights"][component] * len(data)))
+        print("Most likely component of " + str(likely[component]) + " points")
+        print("Average duration value " + str(means[component]))
+        print("Standard deviation is " + str(stds[component]))
+        print("***** End of mixture component *******\n")
+    print("Log likelihood " + str(model["log_likelihood"]) + " after " + str(model["iterations"]) + " iterations\n")
+
+def read_durations(file, chunk_rows=CHUNK_ROWS):
     """
-       Preprocess input file data and remove
+       Stream stop durations of at least MIN_DURATION seconds from a csv file in chunks
 
        :param :
         file: Input csv file
+        chunk_rows: number of rows parsed at a time
 
        :return:
-        data: preprocessed data
-
+        durations: generator of float64 arrays
     """
-    data = []
     # open file
     with open(file, encoding="utf-8") as f:
         # Skip first header line
         next(f)
-        # read csv data file
-        csv_readfile = csv.reader(f, delimiter=',')
-        for row in csv_readfile:
-            # Filter data and remove durations less than 0.5 seconds
-            if float(row[1]) >= 0.5:
-                data.append(row[1])
-
-    return data
+        while True:
+            # Parse the duration column of the next chunk of lines straight into floats
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                break
+            durations = np.loadtxt(lines, delimiter=",", usecols=1, ndmin=1)
+            yield durations[durations >= MIN_DURATION]
+
+def histogram_file(file):
+    """
+       Log spaced histogram of the stop durations of a csv file
+
+       :param :
+        file: Input csv file
+
+       :return:
+        histogram: histogram of the durations
+    """
+    histogram = new_histogram(MIN_DURATION, HIST_MAX_DURATION, log=True)
+    for durations in read_durations(file):
+        add_to_histogram(histogram, durations)
+
+    return histogram
+
+def show_histogram_cluster(histogram, threshold):
+    """
+        Displays all properties of a cluster held in a histogram
+
+       :param :
+        histogram: Histogram of the cluster
+        threshold: Threshold value used for the cluster
+
+       :return:
+        None
+    """
+    # calculate size of cluster
+    size = histogram["count"].sum()
+    # calculate average of points
+    avg = histogram["sum"].sum() / size
+    # Print cluster properties
+    print("***** Cluster *******")
+    print("Cluster size "+ str(int(size)))
+    print("Average duration value "+ str(avg))
+    print("Standard deviation is " + str(math.sqrt(max(histogram["squares"].sum() / size - avg * avg, 0))))
+    print("Minimum duration value " + str(histogram["minimum"].min()))
+    print("Maximum duration value " + str(histogram["maximum"].max()))
+    print("Threshold duration value " + str(threshold))
+    print("***** End of cluster *******\n")
+
+def stream_clusters(files, clusters=CLUSTERS):
+    """
+       Cluster the stop durations of csv files with optimal multi level thresholding of their merged histogram
+
+       :param :
+        files: Input csv files
+        clusters: Number of clusters
+
+       :return:
+        None
+    """
+    with ProcessPoolExecutor() as executor:
+        histogram = merge_histograms(list(executor.map(histogram_file, files)))
+    # Print the total data points after cleaning
+    print("Total number of data points "+str(int(histogram["count"].sum()))+"\n")
+
+    thresholds = histogram_multi_otsu(histogram, clusters)
+
+    # Display cluster properties sorted by average duration
+    for lower, threshold in zip([MIN_DURATION] + thresholds, thresholds + [None]):
+        if threshold is None:
+            cluster = histogram
+        else:
+            cluster, histogram = split_histogram(histogram, threshold)
+        show_histogram_cluster(cluster, lower)
+
+def preprocess(file):
+    """
+       Preprocess input file data and remove durations less than MIN_DURATION seconds
+
+       :param :
+        file: Input csv file
+
+       :return:
+        data: preprocessed float64 array of durations
+
+    """
+    return np.concatenate([np.empty(0)] + list(read_durations(file)))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
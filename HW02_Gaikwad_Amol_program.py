@@ -2,17 +2,33 @@
 Author: Amol Gaikwad
 
 This program builds a one dimensional classifier from vehicle data set. It plots the cost function vs threshold speed.
-Finally, it plots the ROC curve showing a plot of true positive rate vs false positive rate.
+Finally, it plots the exact ROC curve showing a plot of true positive rate vs false positive rate and its area.
+With --bootstrap the drivers are resampled with replacement in a process pool, and confidence intervals of the best
+threshold, its cost and the ROC curve are printed and plotted.
 
 """
 __author__ = 'Amol Gaikwad'
 
 import sys
 import csv
-import math
 import numpy as np
 import warnings
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as mplot
+from HW_Gaikwad_Amol_Otsu import otsu
+from HW_Gaikwad_Amol_Roc import roc_curve, roc_auc, tpr_at, operating_points
+
+# Default cost of letting an aggressive driver through and of pulling over a non reckless driver
+MISS_COST = 1
+FALSE_ALARM_COST = 3
+# Number of bootstrap replicates, and of replicates drawn at a time by a worker
+BOOTSTRAP_REPLICATES = 2000
+BOOTSTRAP_BATCH = 250
+# Confidence level of the bootstrap intervals
+CONFIDENCE = 0.95
+# False positive rates the bootstrap ROC band is computed at
+ROC_GRID = np.linspace(0, 1, 101)
 
 def main():
     """
@@ -21,18 +37,24 @@ def main():
 
         :param : Command line arguments
         :argv[1]: CSV file to be loaded
+        :argv[2]: Optional cost of letting an aggressive driver through
+        :argv[3]: Optional cost of pulling over a non reckless driver
+        :--bootstrap: Also print and plot bootstrap confidence intervals
 
         :return: None
     """
     warnings.filterwarnings("ignore")
+    args = [arg for arg in sys.argv if arg != "--bootstrap"]
     # Read number of arguments
-    noofargs = len(sys.argv)
+    noofargs = len(args)
 
     # Check for invalid number of arguments
-    if (noofargs != 2):
+    if (noofargs != 2 and noofargs != 4):
         print("Invalid number of arguments")
     else:
-        file = sys.argv[1]
+        file = args[1]
+        miss_cost = float(args[2]) if noofargs == 4 else MISS_COST
+        false_alarm_cost = float(args[3]) if noofargs == 4 else FALSE_ALARM_COST
 
         # Preprocess the input file
         speedlist, want_to_speed = preprocess(file)
@@ -41,7 +63,7 @@ def main():
         speedlist = [round(float(i)) for i in speedlist]
 
         # Perform one dimensional classification and return
-        threshold_list, cost_function_list, false_alarm_rate_list, true_positive_rate_list, lowest_cost_fp, lowest_cost_tp = one_dimensional(speedlist, want_to_speed)
+        threshold_list, cost_function_list, false_alarm_rate_list, true_positive_rate_list, lowest_cost_fp, lowest_cost_tp = one_dimensional(speedlist, want_to_speed, miss_cost, false_alarm_cost)
 
         # Compute Otsu's threshold
         otsu_threshold = otsu(speedlist)
@@ -52,20 +74,35 @@ def main():
         # Print point on ROC curve corresponding to lowest value of cost function
         print("Point with lowest cost function on ROC curve ("+str(lowest_cost_fp)+", "+str(lowest_cost_tp)+")")
 
+        # Compute the ROC curve at every distinct speed and its area
+        roc = roc_curve(speedlist, want_to_speed)
+        print("Area under ROC curve "+str(roc_auc(roc)))
+
         # Plot cost function vs threshold speed
         plotdata(threshold_list,cost_function_list,"Cost function vs Threshold", "Threshold speed in mph", "Cost function")
 
         # Plot ROC curve
-        roc_curve_plot(false_alarm_rate_list, true_positive_rate_list,"ROC curve", "False positive rate", "True positive rate", lowest_cost_fp, lowest_cost_tp)
+        roc_curve_plot(roc["fpr"], roc["tpr"],"ROC curve", "False positive rate", "True positive rate", lowest_cost_fp, lowest_cost_tp)
+
+        if "--bootstrap" in sys.argv:
+            # Resample the drivers and print confidence intervals
+            low, high = show_bootstrap(bootstrap(speedlist, want_to_speed, miss_cost=miss_cost,
+                                                 false_alarm_cost=false_alarm_cost))
 
-def one_dimensional(data, want_to_speed):
+            # Plot ROC curve within its confidence band
+            roc_band_plot(roc["fpr"], roc["tpr"], low, high, "ROC curve with bootstrap confidence band",
+                          "False positive rate", "True positive rate")
+
+def one_dimensional(data, want_to_speed, miss_cost=MISS_COST, false_alarm_cost=FALSE_ALARM_COST):
     """
-           Implement one dimensional classification. Compute best threshold to minimize cost function, false negatives,
-           false positives, true positives and true negatives and returns data for plots.
+           Implement one dimensional classification. Compute best threshold to minimize cost function at the lowest
+           cost point of the ROC curve, false negatives and false positives and returns data for plots.
 
            :param :
             data: Input speed data for classification
             want_to_speed: Input data values for drivers wanting to speed
+            miss_cost: Cost of letting an aggressive driver through
+            false_alarm_cost: Cost of pulling over a non reckless driver
 
            :return:
             threshold_list: Returns list of speed threshold values
@@ -76,144 +113,144 @@ def one_dimensional(data, want_to_speed):
             lowest_cost_tp: Returns true positive rate value for lowest cost function
 
     """
+    roc = roc_curve(data, want_to_speed)
+    best = int(operating_points(roc, miss_cost, false_alarm_cost)["index"])
+    misses = roc["positives"] - roc["true_positives"]
+    false_alarms = roc["false_positives"]
 
-    # set the best misclassification rate and best threshold to infinity
-    best_misclass_rate = math.inf
-    best_threshold = math.inf
-
-    # set the false positive rate value and true positive rate value for lowest cost function to 0
-    lowest_cost_fp = 0
-    lowest_cost_tp = 0
-
-    # set the range of threshold values
-    threshold_min = math.floor(min(data))
-    threshold_max = math.ceil(max(data))
-
-    # list to store cost function values
-    cost_function_list =[]
-    # list to store threshold values
-    threshold_list =[]
-    # list to store false positives rate
-    false_alarm_rate_list = []
-    # list to store true positives rate
-    true_positive_rate_list = []
-    # set number of aggressive drivers let through to 0
-    num_aggressive_drivers = 0
-    # set the non reckless drivers pulled over to 0
-    num_nonreckless_drivers = 0
-
-    for threshold in range(threshold_min, threshold_max):
-        # initialize cost function to 0
-        cost_function = 0
-        # list to store misses or false negatives
-        list_misses = []
-        # list to store false positives
-        list_false_alarm = []
-        # list to store true positives
-        list_true_positive = []
-        # add threshold value to threshold list
-        threshold_list.append(threshold)
-        # Initialize count of drivers having want to speed as 0 to 0
-        num_not_speeding = 0
-        # Initialize count of drivers having want to speed as 1 to 0
-        num_speeding = 0
-
-
-        for index in range(0, len(data)):
-            if data[index] < threshold:
-                # Drivers having speed less than threshold
-                if int(want_to_speed[index]) == 1:
-                    # Drivers having having speed less than threshold and want to speed as 1. Add to list of misses.
-                    list_misses.append(data[index])
-                    # Increment count of drivers having want to speed as 1
-                    num_speeding += 1
-                else:
-                    # Increment count of drivers having want to speed as 0
-                    num_not_speeding += 1
-            elif data[index] >= threshold:
-                # Drivers having speed more than equal to threshold
-                if int(want_to_speed[index]) == 0:
-                    # Add to list of false alarms i.e. false positives.
-                    list_false_alarm.append(data[index])
-                    # Increment count of drivers having want to speed as 0
-                    num_not_speeding+= 1
-                else:
-                    # Add to list of true positives.
-                    list_true_positive.append(data[index])
-                    # Increment count of drivers having want to speed as 1
-                    num_speeding += 1
-
-        # Define cost function
-        cost_function = len(list_misses) + 3 * len(list_false_alarm)
-        # Add computed cost function to list
-        cost_function_list.append(cost_function)
-
-
-        if cost_function <= best_misclass_rate:
-            # Set best_misclass_rate and best_threshold
-            best_misclass_rate = cost_function
-            best_threshold = threshold
-            # Count aggressive drivers let through
-            num_aggressive_drivers = len(list_misses)
-            # Count non reckless drivers pulled over
-            num_nonreckless_drivers = len(list_false_alarm)
-            # Computes false positive rate value for lowest cost function
-            lowest_cost_fp = len(list_false_alarm)/ num_not_speeding
-            # Computes true positive rate value for lowest cost function
-            lowest_cost_tp = len(list_true_positive)/ num_speeding
-
-        # Compute false alarm rate
-        false_alarm_rate_list.append(len(list_false_alarm)/ num_not_speeding)
-        # Compute true positive rate
-        true_positive_rate_list.append(len(list_true_positive)/ num_speeding)
+    best_threshold = roc["thresholds"][best]
+    if best_threshold.is_integer():
+        best_threshold = int(best_threshold)
 
     # Print one dimensional threshold
     print("One dimensional classifier threshold " + str(best_threshold)+" mph")
     # Print number of aggressive drivers let through i.e. false negatives
-    print("No of aggressive drivers let through is "+str(num_aggressive_drivers))
+    print("No of aggressive drivers let through is "+str(misses[best]))
     # Print number of non reckless drivers pulled over i.e. false positives
-    print("No of non reckless drivers pulled over is " + str(num_nonreckless_drivers))
+    print("No of non reckless drivers pulled over is " + str(false_alarms[best]))
+
+    # Define cost function, listed from the lowest threshold up without the infinite one
+    cost = miss_cost * misses + false_alarm_cost * false_alarms
 
-    return threshold_list, cost_function_list, false_alarm_rate_list, true_positive_rate_list, lowest_cost_fp, lowest_cost_tp
+    return roc["thresholds"][:0:-1].tolist(), cost[:0:-1].tolist(), roc["fpr"][:0:-1].tolist(), \
+        roc["tpr"][:0:-1].tolist(), float(roc["fpr"][best]), float(roc["tpr"][best])
 
-def otsu(data):
+def speed_counts(data, want_to_speed):
     """
-       Implement Otsu's method to separate data into clusters
+       Count drivers wanting to speed and not at every unique speed
 
        :param :
-        data: Input data from which clusters are to be formed
+        data: Input speed data
+        want_to_speed: Input data values for drivers wanting to speed
 
        :return:
-        best_threshold: Returns the best threshold value using which clusters can be split
+        speeds: sorted float64 array of unique speeds
+        speeding: int64 array of the number of drivers wanting to speed at every speed
+        not_speeding: int64 array of the number of other drivers at every speed
+    """
+    speeds, cell = np.unique(np.asarray(data, dtype=np.float64), return_inverse=True)
+    wants = np.asarray(want_to_speed, dtype=np.int64) == 1
+    speeding = np.bincount(cell[wants], minlength=len(speeds))
+
+    return speeds, speeding, np.bincount(cell, minlength=len(speeds)) - speeding
 
+def bootstrap_batch(counts, replicates, seed, miss_cost=MISS_COST, false_alarm_cost=FALSE_ALARM_COST):
+    """
+       Best threshold, its cost and the ROC curve of bootstrap replicates. Drawing every driver with replacement
+       is the same as drawing the counts of every speed and class from a multinomial, which draws a whole batch of
+       replicates at once without generating an index per driver.
+
+       :param :
+        counts: speeds, speeding and not_speeding from speed_counts
+        replicates: number of replicates
+        seed: seed of the random generator of the batch
+        miss_cost: Cost of letting an aggressive driver through
+        false_alarm_cost: Cost of pulling over a non reckless driver
+
+       :return:
+        batch: dictionary of the best threshold, its cost, the area under the ROC curve and the true positive rate
+               at every rate of ROC_GRID of every replicate holding both classes
+    """
+    speeds, speeding, not_speeding = counts
+    cells = np.concatenate((speeding, not_speeding))
+    drawn = np.random.default_rng(seed).multinomial(cells.sum(), cells / cells.sum(), size=replicates)
+    speeding = drawn[:, :len(speeds)]
+    not_speeding = drawn[:, len(speeds):]
+    # Rates are undefined for a replicate missing a class
+    both = (speeding.sum(axis=1) > 0) & (not_speeding.sum(axis=1) > 0)
+    speeding = speeding[both]
+    not_speeding = not_speeding[both]
+
+    # ROC curve of every replicate in counts, thresholds from infinity down through every speed
+    zeros = np.zeros((len(speeding), 1), dtype=np.int64)
+    true_positives = np.concatenate((zeros, np.cumsum(speeding[:, ::-1], axis=1)), axis=1)
+    false_positives = np.concatenate((zeros, np.cumsum(not_speeding[:, ::-1], axis=1)), axis=1)
+    positives = true_positives[:, -1:]
+    negatives = false_positives[:, -1:]
+
+    # Lowest cost point of every replicate, the first one being the highest threshold as in operating_points
+    cost = miss_cost * (positives - true_positives) + false_alarm_cost * false_positives
+    best = np.argmin(cost, axis=1)
+    fpr = false_positives / negatives
+    tpr = true_positives / positives
+
+    return {"thresholds": np.concatenate(([np.inf], speeds[::-1]))[best],
+            "cost": cost[np.arange(len(cost)), best].astype(np.float64),
+            "auc": roc_auc({"fpr": fpr, "tpr": tpr}), "tpr": tpr_at(fpr, tpr, ROC_GRID)}
+
+def bootstrap(data, want_to_speed, replicates=BOOTSTRAP_REPLICATES, miss_cost=MISS_COST,
+              false_alarm_cost=FALSE_ALARM_COST, seed=None, workers=None):
+    """
+       Bootstrap the one dimensional classifier, batches of replicates running in a process pool. Every batch has
+       its own seed spawned from one seed, so the result does not depend on the number of workers.
+
+       :param :
+        data: Input speed data
+        want_to_speed: Input data values for drivers wanting to speed
+        replicates: number of replicates
+        miss_cost: Cost of letting an aggressive driver through
+        false_alarm_cost: Cost of pulling over a non reckless driver
+        seed: seed of the replicates, None for a fresh one
+        workers: number of worker processes, defaults to the CPU count
+
+       :return:
+        replicates: dictionary of the best threshold, its cost, the area under the ROC curve and the true positive
+                    rate at every rate of ROC_GRID of every replicate
+    """
+    sizes = [min(BOOTSTRAP_BATCH, replicates - start) for start in range(0, replicates, BOOTSTRAP_BATCH)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    batch = functools.partial(bootstrap_batch, speed_counts(data, want_to_speed), miss_cost=miss_cost,
+                              false_alarm_cost=false_alarm_cost)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        batches = list(executor.map(batch, sizes, seeds))
+
+    return {column: np.concatenate([result[column] for result in batches]) for column in batches[0]}
+
+def show_bootstrap(replicates, confidence=CONFIDENCE):
+    """
+       Displays percentile confidence intervals of a bootstrap
+
+       :param :
+        replicates: Replicates from bootstrap
+        confidence: Confidence level of the intervals
+
+       :return:
+        low: true positive rate at every rate of ROC_GRID the ROC band starts at
+        high: true positive rate at every rate of ROC_GRID the ROC band ends at
     """
-    # set the best mix varaiance and best threshold to infinity
-    best_mix_variance = math.inf
-    best_threshold = math.inf
-
-    for threshold in data:
-        # Get data points less than equal to threshold
-        wt_under = [float(point) for point in data if float(point) <= float(threshold)]
-        # Get data points greater than threshold
-        wt_over = [float(point) for point in data if float(point) > float(threshold)]
-        # calculate weight under fraction
-        wt_under_fraction = len(wt_under) / len(data)
-        # calculate weight over fraction
-        wt_over_fraction = len(wt_over) / len(data)
-
-        # calculate variance under
-        variance_under = np.var(wt_under)
-        # calculate variance over
-        variance_over = np.var(wt_over)
-        # calculate mix variance
-        mix_variance = wt_under_fraction * variance_under + wt_over_fraction * variance_over
-
-        # Set best mix variance and best threshold
-        if mix_variance < best_mix_variance:
-            best_mix_variance = mix_variance
-            best_threshold = threshold
-
-    return best_threshold
+    tails = [(1 - confidence) / 2, (1 + confidence) / 2]
+    level = "{:g}% confidence interval of the ".format(confidence * 100)
+    # Thresholds are kept to ones the replicates chose
+    threshold = np.quantile(replicates["thresholds"], tails, method="inverted_cdf")
+    cost = np.quantile(replicates["cost"], tails)
+    auc = np.quantile(replicates["auc"], tails)
+
+    print("Bootstrap replicates "+str(len(replicates["thresholds"])))
+    print(level+"threshold [{:g}, {:g}] mph".format(*threshold))
+    print(level+"lowest cost ["+str(cost[0])+", "+str(cost[1])+"]")
+    print(level+"area under ROC curve ["+str(auc[0])+", "+str(auc[1])+"]")
+
+    return np.quantile(replicates["tpr"], tails, axis=0)
 
 def plotdata(xdata, ydata, title, xlabel, ylabel):
     """
@@ -275,6 +312,34 @@ def roc_curve_plot(xdata, ydata, title, xlabel, ylabel, xpoint, ypoint):
 
     mplot.show()
 
+def roc_band_plot(xdata, ydata, low, high, title, xlabel, ylabel):
+    """
+       Displays the ROC curve plot for ydata vs xdata within a band over ROC_GRID
+
+       :param :
+        xdata: Input data to be plotted on x axis
+        ydata: Input data to be plotted on y axis
+        low: Lower edge of the band at every rate of ROC_GRID
+        high: Upper edge of the band at every rate of ROC_GRID
+        title: Title of plot
+        xlabel: Label x axis
+        ylabel: Label y axis
+
+       :return:
+        None
+    """
+    mplot.figure(figsize=[20, 10])
+    # Shade the band and plot the curve over it
+    mplot.fill_between(ROC_GRID, low, high, alpha=0.3)
+    mplot.plot(xdata, ydata, marker="o")
+    # Set plot title
+    mplot.title(title)
+    # Set plot x-axis label
+    mplot.xlabel(xlabel)
+    # Set plot y-axis label
+    mplot.ylabel(ylabel)
+
+    mplot.show()
 
 def preprocess(file):
     """
@@ -0,0 +1,151 @@
+"""
+Author: Amol Gaikwad
+
+Parzen kernel density estimation. The data is linearly binned onto a regular grid and the bin weights are
+convolved with the sampled kernel through the FFT, so the cost depends on the grid size rather than the number of
+points. The bandwidth is the standard deviation of the kernel, which lets Silverman's and Scott's rules apply to
+every kernel.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import math
+import numpy as np
+
+# Supported kernels
+KERNELS = ("gaussian", "epanechnikov", "tophat", "triangular")
+# Default number of grid points
+GRID_POINTS = 2048
+# Number of bandwidths a gaussian kernel is cut off at
+GAUSSIAN_CUTOFF = 4.0
+
+def silverman_bandwidth(values):
+    """
+       Silverman's rule of thumb, robust to heavy tails through the interquartile range
+
+       :param :
+        values: float64 array of data points
+
+       :return:
+        bandwidth: 0.9 min(std, IQR / 1.34) n^(-1/5)
+    """
+    spread = np.std(values)
+    iqr = np.subtract(*np.percentile(values, [75, 25]))
+    if iqr > 0:
+        spread = min(spread, iqr / 1.34)
+
+    return 0.9 * spread * len(values) ** -0.2
+
+def scott_bandwidth(values):
+    """
+       Scott's normal reference rule
+
+       :param :
+        values: float64 array of data points
+
+       :return:
+        bandwidth: 1.06 std n^(-1/5)
+    """
+    return 1.06 * np.std(values) * len(values) ** -0.2
+
+def kernel_support(kernel):
+    """
+       Half width of a kernel with unit standard deviation
+
+       :param :
+        kernel: one of KERNELS
+
+       :return:
+        support: distance beyond which the kernel is zero
+    """
+    if kernel == "gaussian":
+        return GAUSSIAN_CUTOFF
+    if kernel == "epanechnikov":
+        return math.sqrt(5)
+    if kernel == "tophat":
+        return math.sqrt(3)
+    if kernel == "triangular":
+        return math.sqrt(6)
+    raise ValueError("Unknown kernel " + str(kernel))
+
+def kernel_values(kernel, u):
+    """
+       Kernel with unit standard deviation
+
+       :param :
+        kernel: one of KERNELS
+        u: float64 array of offsets in bandwidths
+
+       :return:
+        values: float64 array of kernel values
+    """
+    support = kernel_support(kernel)
+    inside = np.abs(u) < support
+    if kernel == "gaussian":
+        return np.exp(-0.5 * u * u) / math.sqrt(2 * math.pi)
+    if kernel == "epanechnikov":
+        return np.where(inside, 0.75 / support * (1 - (u / support) ** 2), 0.0)
+    if kernel == "tophat":
+        return np.where(inside, 0.5 / support, 0.0)
+
+    return np.where(inside, (1 - np.abs(u) / support) / support, 0.0)
+
+def linear_binning(values, low, step, points):
+    """
+       Spread every data point over its two nearest grid points in proportion to its distance from them
+
+       :param :
+        values: float64 array of data points
+        low: first grid point
+        step: grid spacing
+        points: number of grid points
+
+       :return:
+        weights: float64 array of the weight of every grid point, summing to the number of data points
+    """
+    position = np.clip((values - low) / step, 0, points - 1)
+    left = np.minimum(position.astype(np.int64), points - 2)
+    right_share = position - left
+
+    return (np.bincount(left, weights=1 - right_share, minlength=points) +
+            np.bincount(left + 1, weights=right_share, minlength=points))
+
+def kde(data, bandwidth="silverman", kernel="gaussian", points=GRID_POINTS):
+    """
+       Kernel density estimate of data on a regular grid
+
+       :param :
+        data: Input data, numbers or numeric strings
+        bandwidth: standard deviation of the kernel, or "silverman" or "scott" for a rule of thumb
+        kernel: one of KERNELS
+        points: number of grid points, at least 2
+
+       :return:
+        grid: float64 array of grid points, covering the data plus the kernel support on both sides
+        density: float64 array of the estimated density at every grid point, integrating to 1
+    """
+    values = np.asarray(data, dtype=np.float64)
+    if bandwidth == "silverman":
+        bandwidth = silverman_bandwidth(values)
+    elif bandwidth == "scott":
+        bandwidth = scott_bandwidth(values)
+    if not bandwidth > 0:
+        # Constant data, fall back to a bandwidth relative to its magnitude
+        bandwidth = max(abs(float(values.mean())), 1.0) * 1e-3
+
+    reach = kernel_support(kernel) * bandwidth
+    grid = np.linspace(values.min() - reach, values.max() + reach, points)
+    step = grid[1] - grid[0]
+    weights = linear_binning(values, grid[0], step, points)
+
+    # Kernel sampled on the grid spacing, normalised so that the discrete kernel sums to one
+    half = min(int(math.ceil(reach / step)), points - 1)
+    kernel_grid = kernel_values(kernel, np.arange(-half, half + 1) * step / bandwidth)
+    kernel_grid /= kernel_grid.sum()
+
+    # Linear convolution through the FFT, zero padded so that it does not wrap around
+    size = 1 << int(math.ceil(math.log2(points + 2 * half + 1)))
+    smoothed = np.fft.irfft(np.fft.rfft(weights, size) * np.fft.rfft(kernel_grid, size), size)[half:half + points]
+    density = np.maximum(smoothed, 0) / (len(values) * step)
+
+    return grid, density
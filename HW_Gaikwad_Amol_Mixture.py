@@ -0,0 +1,188 @@
+"""
+Author: Amol Gaikwad
+
+One dimensional Gaussian mixture clustering, optionally of the logarithm of the data for a log-normal mixture.
+The data is reduced to weighted points, its unique values or, when it is large, the means of bins holding equal
+shares of them together with the spread of the data within every bin, and EM runs on all points and components at
+once in log space. Components start from the classes of the optimal Otsu
+thresholds of the same points.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import math
+import numpy as np
+from HW_Gaikwad_Amol_Otsu import optimal_splits
+
+# Inputs with more unique values than this are binned before EM
+MIXTURE_BIN_LIMIT = 4096
+# Number of bins of binned EM, each holding an equal share of the unique values
+MIXTURE_BINS = 4096
+# Maximum number of EM iterations and relative change of the log likelihood at which EM stops
+MIXTURE_ITERATIONS = 500
+MIXTURE_TOLERANCE = 1e-8
+
+def weighted_points(values, bins=MIXTURE_BINS, bin_limit=MIXTURE_BIN_LIMIT):
+    """
+       Reduce data to sorted weighted points
+
+       :param :
+        values: float64 array of data points
+        bins: number of bins when binning
+        bin_limit: largest number of unique values kept exactly
+
+       :return:
+        points: sorted float64 array of unique values or bin means
+        weights: float64 array of the number of data points at every point
+        spreads: float64 array of the variance of the data within every bin, 0 when the points are exact
+    """
+    values = np.sort(values)
+    points, starts, weights = np.unique(values, return_index=True, return_counts=True)
+    if len(points) <= bin_limit:
+        return points, weights.astype(np.float64), np.zeros(len(points))
+
+    # Bins holding equal shares of the unique values, so that a long tail does not widen the dense bins
+    starts = starts[np.linspace(0, len(points), bins, endpoint=False).astype(np.int64)]
+    counts = np.diff(np.append(starts, len(values)))
+    means = np.add.reduceat(values, starts) / counts
+    deviation = values - np.repeat(means, counts)
+
+    return means, counts.astype(np.float64), np.add.reduceat(deviation * deviation, starts) / counts
+
+def log_densities(points, model):
+    """
+       Log of the weighted density of every component at every point
+
+       :param :
+        points: float64 array of points, in log space for a log-normal mixture
+        model: mixture from gaussian_mixture
+
+       :return:
+        log_density: float64 array of shape (len(points), components)
+    """
+    variances = model["variances"]
+    # Built in place, this runs over every data point when assigning them
+    log_density = points[:, None] - model["means"]
+    log_density *= log_density
+    log_density *= -0.5 / variances
+    log_density += np.log(model["weights"]) - 0.5 * np.log(2 * math.pi * variances)
+
+    return log_density
+
+def log_sum_exp(log_density):
+    """
+       Log of the sum over components without overflow
+
+       :param :
+        log_density: float64 array of shape (n, components)
+
+       :return:
+        log_total: float64 array of shape (n,)
+    """
+    largest = log_density.max(axis=1)
+
+    return largest + np.log(np.exp(log_density - largest[:, None]).sum(axis=1))
+
+def gaussian_mixture(data, components, log_normal=False, iterations=MIXTURE_ITERATIONS,
+                     tolerance=MIXTURE_TOLERANCE):
+    """
+       Fit a one dimensional Gaussian mixture with EM
+
+       :param :
+        data: Input data, numbers or numeric strings, positive for a log-normal mixture
+        components: number of components
+        log_normal: fit the mixture to the logarithm of the data
+        iterations: maximum number of EM iterations
+        tolerance: relative change of the log likelihood at which EM stops
+
+       :return:
+        model: dictionary of component weights, means and variances, in log space for a log-normal mixture, the
+               log likelihood of the points EM ran on and the number of iterations
+    """
+    values = np.asarray(data, dtype=np.float64)
+    if log_normal:
+        values = np.log(values)
+    points, weights, spreads = weighted_points(values)
+    total = weights.sum()
+    components = min(components, len(points))
+
+    # Shift by the mean so that the sums of squares do not lose precision
+    centre = (weights * points).sum() / total
+    shifted = points - centre
+    # Sums of squares of the data at every point, the spread within a bin included
+    squares = weights * (shifted * shifted + spreads)
+    # Variances never shrink below a tiny part of the overall spread
+    floor = max(1e-9 * squares.sum() / total, 1e-300)
+
+    # Start from the classes of the optimal Otsu thresholds
+    ends = optimal_splits(weights, weights * shifted, squares, components)
+    bounds = np.concatenate(([0], np.array(ends, dtype=np.int64) + 1))
+    counts = np.add.reduceat(weights, bounds)
+    means = np.add.reduceat(weights * points, bounds) / counts
+    deviation = points - np.repeat(means, np.diff(np.append(bounds, len(points))))
+    model = {"weights": counts / total, "means": means,
+             "variances": np.maximum(np.add.reduceat(weights * (deviation * deviation + spreads), bounds) / counts,
+                                     floor),
+             "log_normal": log_normal, "log_likelihood": -math.inf, "iterations": 0}
+
+    for iteration in range(1, iterations + 1):
+        # E step: responsibilities of every component for every point
+        log_density = log_densities(points, model)
+        log_total = log_sum_exp(log_density)
+        responsibility = np.exp(log_density - log_total[:, None]) * weights[:, None]
+        log_likelihood = float((weights * log_total).sum())
+
+        # M step: weighted moments of every component, a bin adding the spread of its data
+        counts = np.maximum(responsibility.sum(axis=0), 1e-300)
+        means = (responsibility * points[:, None]).sum(axis=0) / counts
+        deviation = points[:, None] - means
+        variances = np.maximum((responsibility * (deviation * deviation + spreads[:, None])).sum(axis=0) / counts,
+                               floor)
+
+        converged = log_likelihood - model["log_likelihood"] <= tolerance * abs(log_likelihood)
+        model.update({"weights": counts / total, "means": means, "variances": variances,
+                      "log_likelihood": log_likelihood, "iterations": iteration})
+        if converged:
+            break
+
+    return model
+
+def soft_assign(model, data):
+    """
+       Probability of every component for every data point
+
+       :param :
+        model: mixture from gaussian_mixture
+        data: Input data, numbers or numeric strings
+
+       :return:
+        responsibility: float64 array of shape (len(data), components), each row summing to 1
+    """
+    values = np.asarray(data, dtype=np.float64)
+    if model["log_normal"]:
+        values = np.log(values)
+    responsibility = log_densities(values, model)
+    responsibility -= responsibility.max(axis=1, keepdims=True)
+    np.exp(responsibility, out=responsibility)
+    responsibility /= responsibility.sum(axis=1, keepdims=True)
+
+    return responsibility
+
+def component_moments(model):
+    """
+       Mean and standard deviation of every component in the units of the data
+
+       :param :
+        model: mixture from gaussian_mixture
+
+       :return:
+        means: float64 array of component means
+        stds: float64 array of component standard deviations
+    """
+    means = model["means"]
+    variances = model["variances"]
+    if not model["log_normal"]:
+        return means, np.sqrt(variances)
+
+    # Moments of a log-normal distribution
+    return np.exp(means + variances / 2), np.sqrt(np.expm1(variances) * np.exp(2 * means + variances))
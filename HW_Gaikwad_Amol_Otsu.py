@@ -0,0 +1,337 @@
+"""
+Author: Amol Gaikwad
+
+Otsu's method shared by the homework programs. The data is sorted once, and prefix sums of the values and their
+squares give the within cluster variance of every split in a single vectorized pass. For data too large to hold
+in memory, the same prefix sums are taken over the bins of a histogram that keeps the count, sum, sum of squares,
+minimum and maximum of the values in every bin. Histograms of chunks, files or workers merge by adding them up.
+Multi level thresholding finds the split into k classes with the lowest within class variance by dynamic
+programming over the unique values or the bins, using divide and conquer since the best split point of a class
+never moves left as its end moves right, one vectorized pass per depth of the divide and conquer. Data with more
+than MULTI_OTSU_LIMIT unique values is split only between bins holding equal numbers of its unique values.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import math
+import numpy as np
+
+# Default number of histogram bins
+HIST_BINS = 4096
+# Largest number of unique values thresholded exactly into more than two classes, more are binned first
+MULTI_OTSU_LIMIT = 65536
+
+def split_variances(values):
+    """
+       Mixed variance of splitting sorted data after each unique value
+
+       :param :
+        values: sorted float64 array
+
+       :return:
+        ends: index one past the last occurrence of each unique value
+        mix_variance: weighted sum of the variances of the points up to and including each unique value and of the
+                      points above it, nan where the points above are none
+    """
+    # Last occurrence of every unique value, a split is only possible between different values
+    ends = np.flatnonzero(np.diff(values, append=np.inf)) + 1
+
+    # Shift by the mean so that the sums of squares do not lose precision
+    shifted = values - values.mean()
+    total = np.cumsum(shifted)
+    total_squares = np.cumsum(shifted * shifted)
+
+    return ends, mix_variances(ends.astype(np.float64), total[ends - 1], total_squares[ends - 1])
+
+def mix_variances(count_under, sum_under, squares_under):
+    """
+       Mixed variance of splits from running totals of the points under each split
+
+       :param :
+        count_under: running count of the points under each split, the last entry covers all points
+        sum_under: running sum of the points under each split
+        squares_under: running sum of squares of the points under each split
+
+       :return:
+        mix_variance: weighted sum of the variances of the points under and over each split, nan where the points
+                      over it are none
+    """
+    count = count_under[-1]
+    count_over = count - count_under
+    sum_over = sum_under[-1] - sum_under
+    squares_over = squares_under[-1] - squares_under
+
+    # Sum of squared deviations of each side, weighted by its fraction this is count times the mixed variance
+    with np.errstate(divide="ignore", invalid="ignore"):
+        deviations_under = np.maximum(squares_under - sum_under * sum_under / count_under, 0)
+        deviations_over = np.maximum(squares_over - sum_over * sum_over / count_over, 0)
+    mix_variance = (deviations_under + deviations_over) / count
+    mix_variance[count_over == 0] = np.nan
+
+    return mix_variance
+
+def otsu(data):
+    """
+       Implement Otsu's method to separate data into clusters
+
+       :param :
+        data: Input data from which clusters are to be formed, numbers or numeric strings
+
+       :return:
+        best_threshold: Returns the best threshold value using which clusters can be split, the first data point
+                        in input order splitting with the lowest mixed variance, infinity if no split exists
+
+    """
+    values = np.asarray(data, dtype=np.float64)
+    if len(values) == 0:
+        return math.inf
+
+    order = np.argsort(values, kind="stable")
+    ends, mix_variance = split_variances(values[order])
+    valid = np.flatnonzero(~np.isnan(mix_variance))
+    if len(valid) == 0:
+        return math.inf
+
+    # Ties go to the value appearing first in the data
+    best = valid[mix_variance[valid] == mix_variance[valid].min()]
+    starts = np.concatenate(([0], ends[:-1]))
+    first_index = np.minimum.reduceat(order, starts)[best]
+
+    return data[int(first_index.min())]
+
+def new_histogram(low, high, bins=HIST_BINS, log=False):
+    """
+       Empty histogram with fixed bins. Values outside the range are counted in the first or last bin, which keeps
+       their statistics exact.
+
+       :param :
+        low: lower edge of the first bin
+        high: upper edge of the last bin
+        bins: number of bins
+        log: space the bin edges logarithmically, low has to be positive
+
+       :return:
+        histogram: dictionary of bin edges and per bin count, sum, sum of squares, minimum and maximum
+    """
+    edges = np.geomspace(low, high, bins + 1) if log else np.linspace(low, high, bins + 1)
+
+    return {"edges": edges, "count": np.zeros(bins), "sum": np.zeros(bins), "squares": np.zeros(bins),
+            "minimum": np.full(bins, np.inf), "maximum": np.full(bins, -np.inf)}
+
+def add_to_histogram(histogram, values):
+    """
+       Count values into a histogram
+
+       :param :
+        histogram: histogram from new_histogram, updated in place
+        values: float64 array of values
+
+       :return:
+        histogram: the updated histogram
+    """
+    bins = len(histogram["count"])
+    idx = np.clip(np.searchsorted(histogram["edges"], values, side="right") - 1, 0, bins - 1)
+
+    histogram["count"] += np.bincount(idx, minlength=bins)
+    histogram["sum"] += np.bincount(idx, weights=values, minlength=bins)
+    histogram["squares"] += np.bincount(idx, weights=values * values, minlength=bins)
+    np.minimum.at(histogram["minimum"], idx, values)
+    np.maximum.at(histogram["maximum"], idx, values)
+
+    return histogram
+
+def merge_histograms(histograms):
+    """
+       Merge histograms with the same bins
+
+       :param :
+        histograms: list of histograms
+
+       :return:
+        histogram: histogram counting every value of every input histogram
+    """
+    merged = {"edges": histograms[0]["edges"]}
+    for column in ("count", "sum", "squares"):
+        merged[column] = np.sum([histogram[column] for histogram in histograms], axis=0)
+    merged["minimum"] = np.min([histogram["minimum"] for histogram in histograms], axis=0)
+    merged["maximum"] = np.max([histogram["maximum"] for histogram in histograms], axis=0)
+
+    return merged
+
+def histogram_otsu(histogram):
+    """
+       Otsu's method over the bins of a histogram in O(bins). Splits are only considered between bins, so the
+       threshold is within one bin of the exact one.
+
+       :param :
+        histogram: histogram from new_histogram
+
+       :return:
+        best_threshold: largest value of the bin ending the best split, so that the points less than equal to it
+                        are the lower cluster, infinity if no split exists
+    """
+    found = np.flatnonzero(histogram["count"])
+    if len(found) == 0:
+        return math.inf
+
+    mix_variance = mix_variances(np.cumsum(histogram["count"][found]), np.cumsum(histogram["sum"][found]),
+                                 np.cumsum(histogram["squares"][found]))
+    valid = np.flatnonzero(~np.isnan(mix_variance))
+    if len(valid) == 0:
+        return math.inf
+
+    # Ties go to the lowest split
+    best = valid[np.argmin(mix_variance[valid])]
+
+    return float(histogram["maximum"][found[best]])
+
+def split_histogram(histogram, threshold):
+    """
+       Split a histogram at a threshold from histogram_otsu
+
+       :param :
+        histogram: histogram from new_histogram
+        threshold: threshold equal to the maximum of a bin
+
+       :return:
+        under: histogram of the bins with values less than equal to threshold
+        over: histogram of the bins with values greater than threshold
+    """
+    lower = histogram["maximum"] <= threshold
+    under = {"edges": histogram["edges"]}
+    over = {"edges": histogram["edges"]}
+    for column in ("count", "sum", "squares"):
+        under[column] = np.where(lower, histogram[column], 0)
+        over[column] = np.where(lower, 0, histogram[column])
+    for column, empty in (("minimum", np.inf), ("maximum", -np.inf)):
+        under[column] = np.where(lower, histogram[column], empty)
+        over[column] = np.where(lower, empty, histogram[column])
+
+    return under, over
+
+def optimal_splits(counts, sums, squares, classes):
+    """
+       Split consecutive groups of points into classes with the lowest total within class sum of squares.
+       D[m, j], the cost of the first j groups in m classes, is the minimum over i of D[m-1, i] + cost(i, j). The
+       best i never decreases with j, so every level is filled by divide and conquer in O(groups log groups). The
+       ranges at the same depth of the divide and conquer do not depend on each other, so each depth is one
+       vectorized pass over all of its candidates.
+
+       :param :
+        counts: float64 array of the number of points in every group, in increasing order of value
+        sums: float64 array of the sum of the points in every group
+        squares: float64 array of the sum of squares of the points in every group
+        classes: number of classes, at most the number of groups
+
+       :return:
+        ends: list of classes - 1 group indices, each class ends after the group at that index
+    """
+    groups = len(counts)
+    count = np.concatenate(([0.0], np.cumsum(counts)))
+    total = np.concatenate(([0.0], np.cumsum(sums)))
+    total_squares = np.concatenate(([0.0], np.cumsum(squares)))
+
+    def cost(first, end):
+        # Sum of squared deviations of groups first to end - 1
+        size = count[end] - count[first]
+        part = total[end] - total[first]
+        return np.maximum(total_squares[end] - total_squares[first] - part * part / size, 0)
+
+    previous = np.full(groups + 1, np.inf)
+    previous[1:] = cost(0, np.arange(1, groups + 1))
+    choices = []
+    for level in range(2, classes + 1):
+        current = np.full(groups + 1, np.inf)
+        choice = np.zeros(groups + 1, dtype=np.int64)
+        # Ranges of ends low..high knowing the best split lies in opt_low..opt_high
+        low = np.array([level])
+        high = np.array([groups])
+        opt_low = np.array([level - 1])
+        opt_high = np.array([groups - 1])
+        while len(low):
+            mid = (low + high) // 2
+            # Candidate splits of all ranges one after another
+            lengths = np.minimum(opt_high, mid - 1) - opt_low + 1
+            starts = np.cumsum(lengths) - lengths
+            node = np.repeat(np.arange(len(mid)), lengths)
+            first = opt_low[node] + np.arange(len(node)) - starts[node]
+            candidates = previous[first] + cost(first, mid[node])
+            # Lowest candidate of every range, ties going to the first as with argmin
+            lowest = np.minimum.reduceat(candidates, starts)
+            best = np.minimum.reduceat(np.where(candidates == lowest[node], np.arange(len(node)), len(node)), starts)
+            current[mid] = lowest
+            choice[mid] = first[best]
+
+            # Left halves keep their lower bound, right halves start from the best split of their middle
+            low, high, opt_low, opt_high = (np.concatenate((low, mid + 1)), np.concatenate((mid - 1, high)),
+                                            np.concatenate((opt_low, choice[mid])),
+                                            np.concatenate((choice[mid], opt_high)))
+            valid = low <= high
+            low, high, opt_low, opt_high = low[valid], high[valid], opt_low[valid], opt_high[valid]
+        choices.append(choice)
+        previous = current
+
+    # Walk the choices back from the last group
+    ends = []
+    end = groups
+    for choice in reversed(choices):
+        end = int(choice[end])
+        ends.append(end - 1)
+
+    return ends[::-1]
+
+def multi_otsu(data, classes, limit=MULTI_OTSU_LIMIT):
+    """
+       Optimal multi level thresholding of data into classes
+
+       :param :
+        data: Input data, numbers or numeric strings
+        classes: number of classes
+        limit: largest number of unique values thresholded exactly, above it every threshold is the largest value
+               of a bin holding an equal share of the unique values
+
+       :return:
+        thresholds: increasing list of up to classes - 1 thresholds, class c holds the points greater than
+                    threshold c - 1 and less than equal to threshold c
+    """
+    values = np.sort(np.asarray(data, dtype=np.float64))
+    if len(values) == 0:
+        return []
+
+    unique, starts = np.unique(values, return_index=True)
+    if len(unique) > limit:
+        # Group the unique values into bins holding equal shares of them, so that dense and sparse ranges are
+        # both resolved, and split only between bins
+        starts = starts[np.linspace(0, len(unique), limit, endpoint=False).astype(np.int64)]
+    counts = np.diff(np.append(starts, len(values)))
+    # Largest value of every group
+    largest = values[np.append(starts[1:], len(values)) - 1]
+
+    # Shift by the mean so that the sums of squares do not lose precision
+    shifted = values - values.mean()
+    sums = np.add.reduceat(shifted, starts)
+    squares = np.add.reduceat(shifted * shifted, starts)
+
+    ends = optimal_splits(counts.astype(np.float64), sums, squares, min(classes, len(starts)))
+
+    return largest[ends].tolist()
+
+def histogram_multi_otsu(histogram, classes):
+    """
+       Optimal multi level thresholding of the bins of a histogram into classes
+
+       :param :
+        histogram: histogram from new_histogram
+        classes: number of classes
+
+       :return:
+        thresholds: increasing list of up to classes - 1 thresholds, each the maximum of the last bin of a class
+    """
+    found = np.flatnonzero(histogram["count"])
+    if len(found) == 0:
+        return []
+
+    ends = optimal_splits(histogram["count"][found], histogram["sum"][found], histogram["squares"][found],
+                          min(classes, len(found)))
+
+    return histogram["maximum"][found[ends]].tolist()
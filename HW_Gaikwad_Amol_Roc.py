@@ -0,0 +1,179 @@
+"""
+Author: Amol Gaikwad
+
+Exact ROC curves shared by the homework programs. Scores are counted per class at every distinct score once, and
+cumulative counts give the true and false positives of a threshold at every distinct score, points scoring at or
+above a threshold being called positive. The lowest expected cost under any weighting of misses and false alarms is
+reached at a vertex of the upper convex hull of the curve, and the best vertex of every weighting is found at once
+by binary search over the slopes of the hull edges, compared on the counts so that ties are exact.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import numpy as np
+
+def roc_curve(scores, labels):
+    """
+       ROC curve with a point at every distinct score
+
+       :param :
+        scores: Input scores, numbers or numeric strings, higher scores are more likely positive
+        labels: Class of every score, 1 or "1" for positive
+
+       :return:
+        roc: curve from count_curve
+    """
+    values, cell = np.unique(np.asarray(scores, dtype=np.float64), return_inverse=True)
+    positive = np.asarray(labels, dtype=np.int64) == 1
+    positives = np.bincount(cell[positive], minlength=len(values))
+
+    return count_curve(values, positives, np.bincount(cell, minlength=len(values)) - positives)
+
+def count_curve(scores, positives, negatives):
+    """
+       ROC curve from the number of positives and negatives at every distinct score, scores nobody holds being
+       skipped
+
+       :param :
+        scores: float64 array of increasing distinct scores
+        positives: int64 array of the number of positives at every score
+        negatives: int64 array of the number of negatives at every score
+
+       :return:
+        roc: dictionary of decreasing thresholds starting at infinity, the false and true positives and their rates
+             at every threshold, and the number of positives and negatives
+    """
+    held = (positives + negatives) > 0
+    # Thresholds from the highest score down
+    scores = scores[held][::-1]
+    true_positives = np.concatenate(([0], np.cumsum(positives[held][::-1])))
+    false_positives = np.concatenate(([0], np.cumsum(negatives[held][::-1])))
+    positives = int(true_positives[-1])
+    negatives = int(false_positives[-1])
+    if positives == 0 or negatives == 0:
+        raise ValueError("Both classes are needed for an ROC curve")
+
+    return {"thresholds": np.concatenate(([np.inf], scores)),
+            "false_positives": false_positives, "true_positives": true_positives,
+            "fpr": false_positives / negatives, "tpr": true_positives / positives,
+            "positives": positives, "negatives": negatives}
+
+def roc_auc(roc):
+    """
+       Area under an ROC curve by the trapezoidal rule, which counts tied scores as half right
+
+       :param :
+        roc: curve from roc_curve, or a dictionary of fpr and tpr arrays of shape (curves, points)
+
+       :return:
+        auc: area under the curve, an array of one area per curve for many curves
+    """
+    fpr = roc["fpr"]
+    tpr = roc["tpr"]
+    auc = (np.diff(fpr, axis=-1) * (tpr[..., 1:] + tpr[..., :-1])).sum(axis=-1) / 2
+
+    return float(auc) if np.ndim(auc) == 0 else auc
+
+def tpr_at(fpr, tpr, grid):
+    """
+       True positive rate of many ROC curves at the same false positive rates, by linear interpolation between
+       their points. Every curve is shifted right by twice its row number, so a single search covers all of them.
+
+       :param :
+        fpr: float64 array of shape (curves, points), nondecreasing along every curve from 0 to 1
+        tpr: float64 array of shape (curves, points)
+        grid: float64 array of false positive rates between 0 and 1
+
+       :return:
+        rates: float64 array of shape (curves, len(grid)), the top of a vertical step where it lies on the grid
+    """
+    curves, points = fpr.shape
+    offset = 2.0 * np.arange(curves)[:, None]
+    shifted = (fpr + offset).ravel()
+    at = (grid[None, :] + offset).ravel()
+    rates = tpr.ravel()
+
+    # Last point at or left of every grid rate and the point after it within the same curve
+    left = np.searchsorted(shifted, at, side="right") - 1
+    right = np.minimum(left + 1, np.repeat(np.arange(1, curves + 1) * points - 1, len(grid)))
+    span = shifted[right] - shifted[left]
+    share = np.divide(at - shifted[left], span, out=np.zeros_like(span), where=span > 0)
+
+    return (rates[left] + share * (rates[right] - rates[left])).reshape(curves, len(grid))
+
+def roc_hull(roc):
+    """
+       Upper convex hull of an ROC curve by a single monotone chain pass. Points that do not turn right between
+       their neighbours lie under the chord of two other points and are dropped at once first, the pass then pops
+       every vertex the next point does not turn right from. Points in the middle of a hull edge are left out.
+
+       :param :
+        roc: curve from roc_curve
+
+       :return:
+        hull: int64 array of the indices of the hull vertices, from the first point of the curve to the last
+    """
+    x = roc["false_positives"]
+    y = roc["true_positives"]
+    # Turn of every inner point from its previous to its next point, exact on the counts
+    turn = (x[1:-1] - x[:-2]) * (y[2:] - y[:-2]) - (y[1:-1] - y[:-2]) * (x[2:] - x[:-2])
+    candidates = np.flatnonzero(np.concatenate(([True], turn < 0, [True]))).tolist()
+    x = x.tolist()
+    y = y.tolist()
+
+    hull = []
+    for point in candidates:
+        while len(hull) >= 2 and (x[hull[-1]] - x[hull[-2]]) * (y[point] - y[hull[-2]]) >= \
+                (y[hull[-1]] - y[hull[-2]]) * (x[point] - x[hull[-2]]):
+            hull.pop()
+        hull.append(point)
+
+    return np.array(hull, dtype=np.int64)
+
+def operating_points(roc, miss_costs=1.0, false_alarm_costs=1.0, priors=None):
+    """
+       Thresholds with the lowest expected cost for any number of cost weightings at once. The expected cost of a
+       point is miss cost * P(positive) * (1 - tpr) + false alarm cost * P(negative) * fpr, lowest where the hull
+       edges turn flatter than the ratio of the false alarm weight to the miss weight. Ties go to the highest
+       threshold.
+
+       :param :
+        roc: curve from roc_curve
+        miss_costs: cost of a positive called negative, a number or an array
+        false_alarm_costs: cost of a negative called positive, a number or an array broadcast against miss_costs
+        priors: probability of the positive class, a number or an array broadcast against the costs, defaults to
+                the fraction of positives of the curve, which makes the cost per point of its data
+
+       :return:
+        points: dictionary of the index into the curve, threshold, fpr, tpr and expected cost of the best point of
+                every weighting, each an array of the broadcast shape of the costs and priors
+    """
+    positives = roc["positives"]
+    negatives = roc["negatives"]
+    miss_costs = np.asarray(miss_costs, dtype=np.float64)
+    false_alarm_costs = np.asarray(false_alarm_costs, dtype=np.float64)
+    if priors is None:
+        miss_weight = miss_costs * positives / (positives + negatives)
+        false_alarm_weight = false_alarm_costs * negatives / (positives + negatives)
+        # Cost of a false alarm in misses, kept exact for ties
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = false_alarm_costs / miss_costs
+    else:
+        priors = np.asarray(priors, dtype=np.float64)
+        miss_weight = miss_costs * priors
+        false_alarm_weight = false_alarm_costs * (1 - priors)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = (false_alarm_weight / negatives) / (miss_weight / positives)
+    # When nothing costs anything every point ties, and the highest threshold is the first point
+    ratios = np.where(np.isnan(ratios), np.inf, ratios)
+    miss_weight, false_alarm_weight, ratios = np.broadcast_arrays(miss_weight, false_alarm_weight, ratios)
+
+    hull = roc_hull(roc)
+    with np.errstate(divide="ignore"):
+        # Edge slopes in true positives per false positive decrease along the hull, vertical edges are infinite
+        slopes = np.diff(roc["true_positives"][hull]) / np.diff(roc["false_positives"][hull])
+    # Number of edges steeper than the ratio, the vertex after them is the best
+    best = hull[np.searchsorted(-slopes, -ratios, side="left")]
+
+    return {"index": best, "thresholds": roc["thresholds"][best], "fpr": roc["fpr"][best], "tpr": roc["tpr"][best],
+            "cost": miss_weight * (1 - roc["tpr"][best]) + false_alarm_weight * roc["fpr"][best]}
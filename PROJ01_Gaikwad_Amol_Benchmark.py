@@ -0,0 +1,434 @@
+"""
+Author: Amol Gaikwad
+
+Synthetic NMEA generator and scale benchmark for the GPS visualization stages. The generator drives a seeded
+vehicle model through cruising, stops, left and right turns and U-turns, and writes realistic $GPRMC/$GPGGA logs
+with void fixes, dropouts and corrupted sentences. The benchmark times every stage at each scale in a fresh
+process and reports wall time, peak RSS and fixes per second.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import os
+import sys
+import time
+import math
+import calendar
+import datetime
+import tempfile
+import resource
+import multiprocessing
+import numpy as np
+import PROJ01_Gaikwad_Amol_GPSVisualization as gps
+
+# Seconds between fixes of generated logs
+FIX_INTERVAL = 0.4
+# Number of fixes generated and formatted at a time
+GENERATE_CHUNK = 1 << 20
+# Start of generated trips
+START_TIME = calendar.timegm((2018, 10, 10, 12, 0, 0))
+START_LAT = 43.1384
+START_LON = -77.4377
+# Fractions of generated fixes that are void, dropped or corrupted
+VOID_RATE = 0.001
+DROPOUT_RATE = 0.0005
+CORRUPT_RATE = 0.0005
+# Knots to metres per second
+KNOTS_TO_MPS = 0.514444
+# Header written by the loggers
+LOG_HEADER = b"Vers 60\nUSE_SERIAL_FEEDBACK=true\nDEVELOPMENT_MODE=false\nUSE_RMC_ONLY=false\n\n"
+# Default benchmark scales in fixes
+BENCH_SCALES = (10000, 100000, 1000000)
+# Benchmarked stages in pipeline order
+BENCH_STAGES = ("parse", "score", "directions", "turns", "stops", "events", "simplify", "kml")
+
+def main():
+    """
+        Main Program
+        Handle command line arguments.
+
+        :param : Command line arguments
+        :argv[1]: generate or bench
+        :argv[2:]: generate <file> <fixes> [seed] | bench [fixes ...]
+
+        :return: None
+    """
+    # Read number of arguments
+    noofargs = len(sys.argv)
+
+    if noofargs in (4, 5) and sys.argv[1] == "generate":
+        seed = int(sys.argv[4]) if noofargs == 5 else 0
+        generate_log(sys.argv[2], int(float(sys.argv[3])), seed)
+    elif noofargs >= 2 and sys.argv[1] == "bench":
+        scales = [int(float(arg)) for arg in sys.argv[2:]] or list(BENCH_SCALES)
+        show_results(benchmark(scales))
+    else:
+        print("Invalid number of arguments")
+
+def sentence_layout(parts):
+    """
+       Fixed width layout of a sentence
+
+       :param :
+        parts: list of literal bytes and (name, integer digits, fraction digits) fields
+
+       :return:
+        template: uint8 array of the sentence with every field zero filled
+        fields: dictionary of field name to (offset, integer digits, fraction digits)
+    """
+    template = bytearray()
+    fields = {}
+    for part in parts:
+        if isinstance(part, bytes):
+            template += part
+        else:
+            name, int_width, frac_width = part
+            fields[name] = (len(template), int_width, frac_width)
+            template += b"0" * int_width + (b"." + b"0" * frac_width if frac_width else b"")
+
+    return np.frombuffer(bytes(template), dtype=np.uint8), fields
+
+RMC_TEMPLATE, RMC_FIELDS = sentence_layout([b"$GPRMC,", ("time", 6, 3), b",", ("status", 1, 0), b",",
+                                            ("lat", 4, 4), b",", ("ns", 1, 0), b",", ("lon", 5, 4), b",",
+                                            ("ew", 1, 0), b",", ("speed", 3, 2), b",", ("heading", 3, 2), b",",
+                                            ("date", 6, 0), b",,,A*", ("checksum", 2, 0), b"\n"])
+GGA_TEMPLATE, GGA_FIELDS = sentence_layout([b"$GPGGA,", ("time", 6, 3), b",", ("lat", 4, 4), b",", ("ns", 1, 0),
+                                            b",", ("lon", 5, 4), b",", ("ew", 1, 0), b",1,08,1.00,",
+                                            ("alt", 4, 1), b",M,-34.4,M,,*", ("checksum", 2, 0), b"\n"])
+
+def fill_number(lines, field, values):
+    """
+       Write non-negative numbers into a fixed width field of every line
+
+       :param :
+        lines: uint8 array of shape (n, width)
+        field: (offset, integer digits, fraction digits)
+        values: numbers to be written, rounded to the fraction digits
+
+       :return:
+        None
+    """
+    offset, int_width, frac_width = field
+    scaled = np.rint(np.asarray(values) * 10 ** frac_width).astype(np.int64)
+    # Columns of the digits from the last one backwards, skipping the decimal point
+    columns = list(range(offset + int_width - 1, offset - 1, -1))
+    if frac_width:
+        columns = list(range(offset + int_width + frac_width, offset + int_width, -1)) + columns
+    for column in columns:
+        lines[:, column] = 48 + scaled % 10
+        scaled //= 10
+
+def fill_checksum(lines, field):
+    """
+       Write the XOR checksum of the bytes between $ and * of every line
+
+       :param :
+        lines: uint8 array of shape (n, width)
+        field: (offset, 2, 0) of the checksum field
+
+       :return:
+        None
+    """
+    offset = field[0]
+    checksum = np.bitwise_xor.reduce(lines[:, 1:offset-1], axis=1)
+    hex_digits = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+    lines[:, offset] = hex_digits[checksum >> 4]
+    lines[:, offset+1] = hex_digits[checksum & 15]
+
+def format_sentences(template, fields, fix):
+    """
+       Format one sentence per fix
+
+       :param :
+        template: uint8 template from sentence_layout
+        fields: field layout from sentence_layout
+        fix: dictionary of fix arrays
+
+       :return:
+        lines: uint8 array of shape (n, width)
+    """
+    lines = np.tile(template, (len(fix["time"]), 1))
+    for name, values in fix.items():
+        if name in fields:
+            if values.dtype == np.uint8:
+                lines[:, fields[name][0]] = values
+            else:
+                fill_number(lines, fields[name], values)
+    fill_checksum(lines, fields["checksum"])
+
+    return lines
+
+def ddmm(degrees):
+    """
+       Convert decimal degrees to unsigned DDMM.MMMM and hemisphere flags
+
+       :param :
+        degrees: signed decimal degrees
+
+       :return:
+        value: DDMM.MMMM values
+        negative: boolean mask of southern or western values
+    """
+    negative = degrees < 0
+    degrees = np.abs(degrees)
+    whole = np.floor(degrees)
+    # Round to the 4 minute decimals written so that 60.0000 minutes never appears
+    minutes = np.minimum(np.rint((degrees - whole) * 600000) / 10000, 59.9999)
+
+    return whole * 100 + minutes, negative
+
+def date_digits(epoch):
+    """
+       DDMMYY of every epoch second
+
+       :param :
+        epoch: epoch seconds
+
+       :return:
+        date: DDMMYY as integers
+    """
+    days, inverse = np.unique((epoch // 86400).astype(np.int64), return_inverse=True)
+    lookup = np.array([int(datetime.datetime.fromtimestamp(int(day) * 86400, datetime.timezone.utc)
+                           .strftime("%d%m%y")) for day in days], dtype=np.int64)
+
+    return lookup[inverse]
+
+def drive_segments(rng, count, state):
+    """
+       Speed and heading rate of the next fixes of the vehicle model
+
+       :param :
+        rng: numpy random generator
+        count: minimum number of fixes to generate
+        state: dictionary with the current speed, carried between calls
+
+       :return:
+        speed: speeds in knots
+        heading_rate: heading changes in degrees per fix
+    """
+    speeds = []
+    rates = []
+    total = 0
+    while total < count:
+        kind = rng.choice(("cruise", "stop", "left", "right", "uturn"), p=(0.55, 0.15, 0.13, 0.13, 0.04))
+        if kind == "cruise":
+            duration, target = rng.uniform(20, 150), rng.uniform(10, 45)
+            rate = rng.normal(0, 0.05, 1) + rng.normal(0, 0.2, max(int(duration / FIX_INTERVAL), 1))
+        elif kind == "stop":
+            duration, target = rng.uniform(5, 120), 0.0
+            rate = np.zeros(max(int(duration / FIX_INTERVAL), 1))
+        elif kind == "uturn":
+            duration, target = rng.uniform(10, 16), rng.uniform(4, 7)
+            rate = np.full(max(int(duration / FIX_INTERVAL), 1), rng.choice((-1, 1)) * rng.normal(180, 5))
+            rate /= len(rate)
+        else:
+            duration, target = rng.uniform(6, 10), rng.uniform(8, 15)
+            rate = np.full(max(int(duration / FIX_INTERVAL), 1), (-1 if kind == "left" else 1) * rng.normal(90, 10))
+            rate /= len(rate)
+
+        n = len(rate)
+        # Ramp speed to the target over the first part of the segment, except when stopped
+        ramp = min(n, max(int(8 / FIX_INTERVAL), 1))
+        speed = np.full(n, target)
+        if target > 0:
+            speed[:ramp] = np.linspace(state["speed"], target, ramp)
+            speed += rng.normal(0, 0.3, n)
+            np.maximum(speed, 0.5, out=speed)
+        state["speed"] = target
+        speeds.append(speed)
+        rates.append(rate)
+        total += n
+
+    return np.concatenate(speeds), np.concatenate(rates)
+
+def generate_log(file, fixes, seed=0):
+    """
+       Write a synthetic NMEA log
+
+       :param :
+        file: output txt file
+        fixes: number of fixes to be generated
+        seed: random seed
+
+       :return:
+        None
+    """
+    rng = np.random.default_rng(seed)
+    state = {"speed": 0.0}
+    epoch = START_TIME
+    lat = math.radians(START_LAT)
+    lon = math.radians(START_LON)
+    heading = rng.uniform(0, 360)
+    radius = gps.EARTH_RADIUS_KM * 1000
+    written = 0
+
+    with open(file, "wb") as f:
+        f.write(LOG_HEADER)
+        while written < fixes:
+            count = min(GENERATE_CHUNK, fixes - written)
+            speed, rate = drive_segments(rng, count, state)
+            speed = speed[:count]
+            rate = rate[:count]
+
+            # Integrate heading and position
+            headings = heading + np.cumsum(rate)
+            heading = float(headings[-1])
+            headings %= 360
+            step = speed * (KNOTS_TO_MPS * FIX_INTERVAL)
+            north = np.cumsum(step * np.cos(np.radians(headings))) / radius + lat
+            east = np.cumsum(step * np.sin(np.radians(headings))) / (radius * math.cos(lat))
+            lat = float(north[-1])
+            east += lon
+            lon = float(east[-1])
+            # Receiver noise while moving
+            moving = speed > 0
+            noise = rng.normal(0, 0.3 / radius, (2, count)) * moving
+            times = epoch + FIX_INTERVAL * np.arange(count)
+            epoch = float(times[-1]) + FIX_INTERVAL
+
+            fix_lat, south = ddmm(np.degrees(north + noise[0]))
+            fix_lon, west = ddmm(np.degrees(east + noise[1]))
+            seconds = times % 86400
+            hhmmss = (seconds // 3600) * 10000 + (seconds % 3600 // 60) * 100 + seconds % 60
+            status = np.where(rng.random(count) < VOID_RATE, ord("V"), ord("A")).astype(np.uint8)
+            ns = np.where(south, ord("S"), ord("N")).astype(np.uint8)
+            ew = np.where(west, ord("W"), ord("E")).astype(np.uint8)
+
+            rmc = format_sentences(RMC_TEMPLATE, RMC_FIELDS, {
+                "time": hhmmss, "status": status, "lat": fix_lat, "ns": ns, "lon": fix_lon, "ew": ew,
+                "speed": speed, "heading": headings, "date": date_digits(times)})
+            gga_seconds = (seconds + FIX_INTERVAL / 2) % 86400
+            gga = format_sentences(GGA_TEMPLATE, GGA_FIELDS, {
+                "time": (gga_seconds // 3600) * 10000 + (gga_seconds % 3600 // 60) * 100 + gga_seconds % 60,
+                "lat": fix_lat, "ns": ns, "lon": fix_lon, "ew": ew, "alt": np.full(count, 146.6)})
+            lines = np.hstack((rmc, gga))
+
+            # Corrupt a byte inside some sentences so that their checksum fails
+            corrupt = np.flatnonzero(rng.random(count) < CORRUPT_RATE)
+            lines[corrupt, rng.integers(7, len(RMC_TEMPLATE) - 4, len(corrupt))] ^= 1
+            # Drop the sentences of some fixes entirely
+            keep = rng.random(count) >= DROPOUT_RATE
+
+            f.write(lines[keep].tobytes())
+            written += count
+
+def run_stage(stage, file, cache_dir):
+    """
+       Run one benchmark stage in the current process
+
+       :param :
+        stage: one of BENCH_STAGES
+        file: NMEA txt file
+        cache_dir: directory of the parsed trip cache, already holding the trip
+
+       :return:
+        seconds: wall time of the stage
+        peak_rss: peak resident set size of the process in bytes
+    """
+    if stage == "parse":
+        start = time.perf_counter()
+        gps.preprocess(file)
+    elif stage == "score":
+        start = time.perf_counter()
+        gps.score_trip(file)
+    else:
+        # Load the trip into memory before timing
+        data = {column: np.array(values) for column, values in gps.load_trip(file, cache_dir).items()}
+        if stage == "kml":
+            # Only writing is timed, detection has stages of its own
+            directions = gps.process_directions(data)
+            turns = gps.check_turns(data)
+            stops = gps.check_stop(data)
+            events = gps.check_events(data)
+        start = time.perf_counter()
+        if stage == "directions":
+            gps.process_directions(data)
+        elif stage == "turns":
+            gps.check_turns(data)
+        elif stage == "stops":
+            gps.check_stop(data)
+        elif stage == "events":
+            gps.check_events(data)
+        elif stage == "simplify":
+            gps.simplify_directions(gps.process_directions(data))
+        elif stage == "kml":
+            with tempfile.TemporaryDirectory() as out_dir:
+                kml = gps.write_kmlfile_header(os.path.join(out_dir, "bench.txt"))
+                gps.write_kmlfile_body(kml, directions)
+                gps.write_kmlfile_body_turn(kml, turns)
+                gps.write_kmlfile_body_stop(kml, stops)
+                gps.write_kmlfile_body_events(kml, events)
+                gps.write_kmlfile_trailer(kml)
+    seconds = time.perf_counter() - start
+
+    return seconds, peak_rss()
+
+def peak_rss():
+    """
+       Peak resident set size of the current process. On Linux ru_maxrss survives exec and would report the peak
+       of the parent, so the high water mark of the current process image is read from /proc instead.
+
+       :param : None
+
+       :return:
+        peak_rss: peak resident set size in bytes
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+def benchmark(scales, bench_dir="bench_logs", seed=0):
+    """
+       Benchmark every stage at every scale. Logs are generated once and reused; each stage runs in a freshly
+       spawned process so that its peak RSS is its own.
+
+       :param :
+        scales: numbers of fixes to be benchmarked
+        bench_dir: directory of the generated logs and their parsed trip cache
+        seed: random seed of the generated logs
+
+       :return:
+        results: list of (fixes, stage, seconds, peak RSS bytes)
+    """
+    os.makedirs(bench_dir, exist_ok=True)
+    cache_dir = os.path.join(bench_dir, "cache")
+    context = multiprocessing.get_context("spawn")
+    results = []
+
+    for fixes in scales:
+        file = os.path.join(bench_dir, "synthetic_"+str(fixes)+"_"+str(seed)+".txt")
+        if not os.path.exists(file):
+            generate_log(file, fixes, seed)
+        gps.load_trip(file, cache_dir)
+        for stage in BENCH_STAGES:
+            with context.Pool(1) as pool:
+                seconds, peak_rss = pool.apply(run_stage, (stage, file, cache_dir))
+            results.append((fixes, stage, seconds, peak_rss))
+
+    return results
+
+def show_results(results):
+    """
+       Print benchmark results as a table
+
+       :param :
+        results: list of (fixes, stage, seconds, peak RSS bytes)
+
+       :return:
+        None
+    """
+    print("{:>10} {:>10} {:>10} {:>12} {:>14}".format("fixes", "stage", "seconds", "peak RSS MB", "fixes/second"))
+    for fixes, stage, seconds, peak_rss in results:
+        print("{:>10} {:>10} {:>10.4f} {:>12.1f} {:>14.0f}".format(fixes, stage, seconds, peak_rss / 2 ** 20,
+                                                                   fixes / max(seconds, 1e-9)))
+
+if __name__ == '__main__':
+    main()
@@ -6,222 +6,518 @@ GPS data visualization
 
 """
 
-import csv
+import io
+import os
+import sys
+import json
+import shutil
+import hashlib
+import zipfile
+import glob
+import calendar
+import functools
 import math
-from haversine import haversine
+import operator
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 __author__ = 'Amol Gaikwad'
 
+# Columns of a parsed trip: epoch seconds, decimal-degree latitude and longitude, speed in knots, heading in degrees
+FIX_COLUMNS = ("time", "lat", "lon", "speed", "heading")
+# Columns of detected stops: start and end epoch seconds, duration in seconds, decimal-degree latitude and longitude
+STOP_COLUMNS = ("start", "end", "duration", "lat", "lon")
+
+# Mean earth radius in kilometres
+EARTH_RADIUS_KM = 6371.0088
+# Stop thresholds: speed in knots, distance in kilometres, minimum stop duration in seconds
+STOP_SPEED = 0.01
+STOP_DISTANCE = 0.002
+STOP_TIME = 0.4
+
+# Kinds of detected turns, indexed by the kind column
+TURN_KINDS = ("left", "right", "uturn")
+# Placemark label of every kind of turn
+TURN_LABELS = ("left turn", "right turn", "U-turn")
+# Columns of detected turns: epoch seconds, decimal-degree latitude and longitude, signed heading change, kind,
+# and epoch seconds of the start of the first and the end of the last turning window
+TURN_COLUMNS = ("time", "lat", "lon", "angle", "kind", "start", "end")
+# Turn thresholds: window in seconds, heading changes in degrees, minimum speed in knots
+TURN_WINDOW = 12.0
+TURN_MIN = 55
+TURN_MAX = 115
+UTURN_MIN = 150
+TURN_SPEED = 1
+
+# Kinds of detected driving events, indexed by the kind column
+EVENT_KINDS = ("acceleration", "braking", "cornering", "speeding")
+# Columns of detected events: start and end epoch seconds, duration in seconds, decimal-degree latitude and
+# longitude of the start, kind, and peak value in m/s^2 for acceleration, braking and cornering or knots for speeding
+EVENT_COLUMNS = ("start", "end", "duration", "lat", "lon", "kind", "peak")
+# Event thresholds: window in seconds, accelerations in m/s^2, speed limit in knots (65 mph)
+EVENT_WINDOW = 1.0
+ACCEL_LIMIT = 2.9
+BRAKE_LIMIT = 3.9
+CORNER_LIMIT = 3.9
+SPEED_LIMIT = 56.5
+# Icon colors of the event layers, indexed by the kind column
+EVENT_COLORS = ("ff00ff00", "ff0000ff", "ff00a5ff", "ffff00ff")
+# Metres per second in a knot
+KNOTS_TO_MS = 0.514444
+
+# Directory of the parsed trip cache and version of its layout, bumped whenever parsing changes
+CACHE_DIR = ".trip_cache"
+CACHE_VERSION = 1
+
+# Track simplification tolerance in metres
+SIMPLIFY_TOLERANCE = 5.0
+
+# Write buffer size in bytes and number of points formatted at a time for kml output
+KML_BUFFER_SIZE = 1 << 20
+KML_CHUNK_SIZE = 65536
+# Closing tags of every kml document
+KML_TRAILER = """      
+            </Document>
+        </kml>
+        """
+
 def main():
     """
         Main Program
-        Handle command line arguments.
+        Handle command line arguments. Scores every trip in parallel and visualizes the cheapest one.
 
-        :param : None
+        :param : Command line arguments
+        :argv[1]: Optional directory or glob pattern of NMEA txt files
+        :argv[2]: Optional number of worker processes
+        :--kmz: Write a zipped kmz instead of a kml
+        :--no-cache: Parse every file instead of using the parsed trip cache
 
         :return: None
     """
-    max_cost = math.inf
-    # List of input txt files
-    inp_files = ["ZIAC_CO0_2018_10_12_1250.txt", "ZIAB_CIU_2018_10_11_1218.txt", "ZIAA_CTU_2018_10_10_1255.txt",
-                 "ZI8N_DG8_2018_08_23_1316.txt", "ZI8K_EV7_2018_08_20_1500.txt", "ZI8J_GKX_2018_08_19_1646.txt",
-                 "ZI8H_HJC_2018_08_17_1745.txt", "ZI8G_ERF_2018_08_16_1428.txt"]
-    # Loop over all files
-    for file in inp_files:
-        # Get valid records
-        orig_data = preprocess(file)
-        # Calculate cost of data
-        cost = get_cost(orig_data)
-
-        # Update max cost if cost < max_cost
-        if cost < max_cost:
-            max_cost = cost
-            cost_data = orig_data
-            min_file = file
+    args = [arg for arg in sys.argv if arg not in ("--kmz", "--no-cache")]
+    kmz = "--kmz" in sys.argv
+    cache_dir = None if "--no-cache" in sys.argv else CACHE_DIR
+    # Read number of arguments
+    noofargs = len(args)
+
+    if noofargs > 3 or (noofargs == 3 and not (args[2].isdigit() and int(args[2]) >= 1)):
+        print("Invalid number of arguments")
+        return
+
+    if noofargs >= 2:
+        inp_files = find_trip_files(args[1])
+    else:
+        # List of input txt files
+        inp_files = ["ZIAC_CO0_2018_10_12_1250.txt", "ZIAB_CIU_2018_10_11_1218.txt", "ZIAA_CTU_2018_10_10_1255.txt",
+                     "ZI8N_DG8_2018_08_23_1316.txt", "ZI8K_EV7_2018_08_20_1500.txt", "ZI8J_GKX_2018_08_19_1646.txt",
+                     "ZI8H_HJC_2018_08_17_1745.txt", "ZI8G_ERF_2018_08_16_1428.txt"]
+    workers = int(args[2]) if noofargs == 3 else None
+
+    if not inp_files:
+        print("No input files found")
+        return
+
+    # Score all files and pick the cheapest one
+    max_cost, min_file = rank_trips(inp_files, workers, cache_dir)[0]
 
     print("Optimum path file " + min_file)
     print("Optimum cost " + str(max_cost))
 
-    # Get latitude and longitude information from data
-    data = process_directions(cost_data)
+    # Load full detail only for the optimum trip
+    cost_data = load_trip(min_file, cache_dir)
+    # Get simplified latitude and longitude information from data
+    data = simplify_directions(process_directions(cost_data))
     # Get latitude and longitude of turns
-    turn_list = check_left_turn(0, cost_data)
+    turn_list = check_turns(cost_data)
     # Emit kml file header
-    file = write_kmlfile_header(min_file)
+    file = write_kmlfile_header(min_file, kmz)
     # Emit kml file body
     file = write_kmlfile_body(file, data)
     # Emit kml file body for turns
     file = write_kmlfile_body_turn(file, turn_list)
-    # Get latitude and longitude of stops
-    stop_list = check_stop(cost_data, data)
+    # Get stop segments
+    stop_list = check_stop(cost_data)
     # Emit kml file body for stops
     file = write_kmlfile_body_stop(file, stop_list)
+    # Get driving events
+    event_list = check_events(cost_data)
+    speeding = event_list["kind"] == EVENT_KINDS.index("speeding")
+    print("Time over speed limit " + str(round(float(event_list["duration"][speeding].sum()), 3)) + " secs")
+    # Emit kml file body for driving events
+    file = write_kmlfile_body_events(file, event_list)
     # Emit kml file trailer
     file = write_kmlfile_trailer(file)
 
+def find_trip_files(pattern):
+    """
+       Find NMEA txt files from a directory or glob pattern
+
+       :param :
+        pattern: directory containing txt files, or a glob pattern
+
+       :return:
+        files: sorted list of matching files
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.txt")
+
+    return sorted(glob.glob(pattern))
+
+def rank_trips(files, workers=None, cache_dir=CACHE_DIR):
+    """
+       Score trips in a process pool
+
+       :param :
+        files: NMEA txt files to be scored
+        workers: number of worker processes, defaults to the CPU count
+        cache_dir: directory of the parsed trip cache, None to disable caching
+
+       :return:
+        ranking: list of (cost, file) sorted from cheapest to most expensive
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        costs = list(executor.map(functools.partial(score_trip, cache_dir=cache_dir), files))
+
+    return sorted(zip(costs, files))
+
+def score_trip(file, cache_dir=None):
+    """
+       Get cost of a trip. With a cache the trip is mapped from (or parsed into) the cache, otherwise its fixes
+       are streamed without keeping them in memory.
+
+       :param :
+        file: Input NMEA txt file
+        cache_dir: directory of the parsed trip cache, None to stream the file
+
+       :return:
+        cost: cost for the trip, infinity if the trip has no valid fixes
+    """
+    if cache_dir is not None:
+        data = load_trip(file, cache_dir)
+        if len(data["time"]) == 0:
+            return math.inf
+        return get_cost(data)
+
+    first_time = None
+    last_time = None
+    max_velocity = -math.inf
+
+    for batch in read_fixes(file):
+        if first_time is None:
+            first_time = batch["time"][0]
+        last_time = batch["time"][-1]
+        max_velocity = max(max_velocity, float(batch["speed"].max()))
+
+    if first_time is None:
+        return math.inf
+
+    return cost_function((last_time - first_time) / 60, max_velocity)
 
+def cost_function(diff_time, max_velocity):
+    """
+       Cost of a trip from its duration and top speed
+
+       :param :
+        diff_time: trip duration in minutes
+        max_velocity: maximum speed in knots
+
+       :return:
+        cost: cost for the trip
+    """
+    return (diff_time/30) + (max_velocity)/(120*0.868976)
 
 def get_cost(data):
     """
        Get cost according to cost function
 
        :param :
-        data: data for which cost is to be calculated
+        data: trip for which cost is to be calculated
 
        :return:
         cost: cost for the data
 
     """
-    # Get initial time in mins
-    initial_time = get_time_mins(data[0][0])
-    # Get last time in mins
-    last_time = get_time_mins(data[len(data)-1][0])
     # Get time in mins
-    diff_time = last_time - initial_time
+    diff_time = (data["time"][-1] - data["time"][0]) / 60
 
     # Get max velocity
-    max_velocity = max([float(row[5]) for row in data])
+    max_velocity = float(data["speed"].max())
 
     # Calculate cost function
-    cost = (diff_time/30) + (max_velocity)/(120*0.868976)
+    cost = cost_function(diff_time, max_velocity)
 
     return cost
 
-def get_time_mins(time):
+def window_ends(time, window):
     """
-       Get time in minutes from UTC time
+       End of the time window of every fix, the first fix at least window seconds later
 
        :param :
-        time: UTC time
+        time: sorted epoch seconds
+        window: window length in seconds, greater than 0
 
        :return:
-        total_min: total time in minutes
+        window_end: index of the fix ending the window of each of the first len(window_end) fixes
+    """
+    window_end = np.searchsorted(time, time + window)
+
+    # Valid windows are a prefix since time is sorted
+    return window_end[:np.searchsorted(window_end, len(time))]
 
+def turning_windows(data):
     """
-    timearr = time.split(".")
-    # Convert hours to mins
-    hours_to_min = float(float(timearr[0][0:2]) * 60)
-    min = float(timearr[0][2:4])
-    # Get seconds information
-    sec = timearr[0][4:6]+"." + timearr[1]
-    # Convert secs to mins
-    sec_to_min = float(sec)/60
+       Heading change over the time window of every fix. The window of a fix ends at the first fix at least
+       TURN_WINDOW seconds later; only fixes whose window ends inside the trip have one.
 
-    total_min = hours_to_min + min + sec_to_min
+       :param :
+        data: input_data
 
-    return total_min
+       :return:
+        window_end: index of the fix ending the window of each of the first len(window_end) fixes
+        delta: wrapped heading change in (-180, 180], negative for left
+        turning: boolean mask of windows turning more than TURN_MIN degrees while moving at both ends
+    """
+    speed = data["speed"]
+    window_end = window_ends(data["time"], TURN_WINDOW)
+    count = len(window_end)
 
-def check_left_turn(idx, data):
+    delta = data["heading"][window_end] - data["heading"][:count]
+    delta += 180
+    np.mod(delta, 360, out=delta)
+    delta -= 180
+    # Only count windows where the vehicle is moving at both ends
+    turning = (np.abs(delta) > TURN_MIN) & (speed[:count] > TURN_SPEED) & (speed[window_end] > TURN_SPEED)
+
+    return window_end, delta, turning
+
+def check_turns(data):
     """
-       Check for left turn
+       Check for left turns, right turns and U-turns. The heading change of every fix is measured against the
+       first fix at least TURN_WINDOW seconds later. Runs of consecutive windows turning more than TURN_MIN degrees
+       form one turn, located at the fix halfway through the run.
 
        :param :
-        idx: starting index of data
         data: input_data
 
        :return:
-        turn_list: latitude and longitude containing turns
-
-    """
-    point_data = []
-    # Set window size
-    window_size = 30
-    # While index doesnt reach end of data
-    while idx < len(data) and idx+window_size < len(data):
-        # Get current angle
-        curr_angle = float(data[idx][6])
-        # Get next angle
-        next_angle = float(data[idx+window_size][6])
-        # Get current speed
-        curr_speed = float(data[idx][5])
-        # Get next speed
-        next_speed = float(data[idx + window_size][5])
-        diff_angle = 0
-        if(curr_angle > next_angle):
-            if (curr_speed > 1 and next_speed > 1):
-                # Calculate angle difference
-                diff_angle = abs(curr_angle - next_angle)
-        else:
-            if (curr_speed > 1 and next_speed > 1):
-                # Calculate angle difference for wrap around case
-                diff_angle = abs(curr_angle+360 - next_angle)
-
-        # Check for left turn
-        if(diff_angle > 55) and (diff_angle < 115):
-            new_idx = (idx+idx+window_size)/2
-            # Get mid point data for turn
-            point = data[math.ceil(new_idx)]
-            point_data.append(point)
-            # If turn found increment index by window size
-            idx += window_size+1
-        else:
-            # Increment index for next data point
-            idx += 1
-
-    turn_list = process_directions(point_data)
+        turn_list: turns containing one array per column in TURN_COLUMNS
+    """
+    time = data["time"]
+    window_end, delta, turning = turning_windows(data)
+
+    # Find start and end of every run of turning windows
+    edges = np.diff(turning.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return {column: np.empty(0, dtype=np.int8 if column == "kind" else np.float64) for column in TURN_COLUMNS}
+
+    # Peak heading change and overall direction of every run. Windows that are not turning are zeroed so that
+    # each reduction from one run start to the next only sees the windows of its own run.
+    delta[~turning] = 0
+    peak = np.maximum.reduceat(np.abs(delta), starts)
+    direction = np.add.reduceat(delta, starts)
+
+    kind = np.full(len(starts), -1, dtype=np.int8)
+    normal = (peak > TURN_MIN) & (peak < TURN_MAX)
+    kind[normal & (direction < 0)] = TURN_KINDS.index("left")
+    kind[normal & (direction >= 0)] = TURN_KINDS.index("right")
+    kind[peak >= UTURN_MIN] = TURN_KINDS.index("uturn")
+    keep = kind >= 0
+
+    # Mid point of the run from its first window start to its last window end
+    start_time = time[starts[keep]]
+    end_time = time[window_end[ends[keep] - 1]]
+    mid = np.searchsorted(time, (start_time + end_time) / 2)
+
+    turn_list = {"time": time[mid], "lat": data["lat"][mid], "lon": data["lon"][mid],
+                 "angle": np.copysign(peak, direction)[keep], "kind": kind[keep], "start": start_time,
+                 "end": end_time}
 
     return turn_list
 
-def check_stop(data, direction_data):
+def haversine_distance(lat1, lon1, lat2, lon2):
     """
-       Check for stop data
+       Great circle distance between arrays of points
+
+       :param :
+        lat1: latitudes of first points in decimal degrees
+        lon1: longitudes of first points in decimal degrees
+        lat2: latitudes of second points in decimal degrees
+        lon2: longitudes of second points in decimal degrees
+
+       :return:
+        dist: distances in kilometres
+    """
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    sin_dlat = np.sin((lat2 - lat1) / 2)
+    sin_dlon = np.sin(np.radians(lon2 - lon1) / 2)
+    a = sin_dlat * sin_dlat + np.cos(lat1) * np.cos(lat2) * sin_dlon * sin_dlon
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def stationary_pairs(data):
+    """
+       Check which pairs of consecutive fixes are stationary
 
        :param :
         data: input_data
-        direction_data: latitude and longitude data
-
-       :return:
-        stop_list: latitude and longitude containing stops
-
-    """
-    idx = 0
-    point_data = []
-    # Loop while you don't reach end of data
-    while idx < len(direction_data)and idx+1 < len(direction_data):
-        # Get current point
-        curr_point = (float(direction_data[idx][0]),float(direction_data[idx][1]))
-        # Get next point
-        next_point = (float(direction_data[idx+1][0]),float(direction_data[idx+1][1]))
-        # Calculate haversine distance
-        dist = haversine(curr_point, next_point)
-        # Initialize thresholds
-        threshold_speed = 0.01
-        threshold_distance = 0.002
-        threshold_time = 0.4
-        # Get current time
-        curr_time = float(data[idx][0])
-        # Get next time
-        next_time = float(data[idx+1][0])
-        # Get time difference
-        time_diff = next_time - curr_time
-        # Get current speed
-        curr_speed = float(data[idx][5])
-        # Append stop data if speed is less than threshold speed and time greater tha threshold time
-        if curr_speed < threshold_speed and time_diff > threshold_time:
-            # Append data if distance less than threshold distance
-            if dist < threshold_distance:
-                point_data.append(data[idx])
-
-        idx += 1
-
-    # Get latitude and longitude for stop data
-    stop_list = process_directions(point_data)
+
+       :return:
+        stationary: boolean mask, True at i when the pair of fixes i and i+1 is stationary
+    """
+    lat = data["lat"]
+    lon = data["lon"]
+    # Calculate haversine distance between consecutive fixes
+    dist = haversine_distance(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+    return (data["speed"][:-1] < STOP_SPEED) & (dist < STOP_DISTANCE)
+
+def check_stop(data):
+    """
+       Check for stop data. A pair of consecutive fixes is stationary when the speed is below STOP_SPEED and the
+       distance moved is below STOP_DISTANCE. Runs of stationary pairs lasting longer than STOP_TIME are stops.
+
+       :param :
+        data: input_data
+
+       :return:
+        stop_list: stop segments containing one array per column in STOP_COLUMNS
+    """
+    lat = data["lat"]
+    lon = data["lon"]
+    stationary = stationary_pairs(data)
+
+    # Find start and end of every run of stationary pairs
+    edges = np.diff(stationary.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    # Run of pairs starts..ends-1 covers fixes starts..ends
+    ends = np.flatnonzero(edges == -1)
+
+    time = data["time"]
+    # NMEA times have millisecond resolution
+    duration = np.round(time[ends] - time[starts], 3)
+    # Keep stops lasting longer than threshold time
+    keep = duration > STOP_TIME
+    starts = starts[keep]
+
+    stop_list = {"start": time[starts], "end": time[ends[keep]], "duration": duration[keep],
+                 "lat": lat[starts], "lon": lon[starts]}
 
     return stop_list
 
-def write_kmlfile_header(file_name):
+def event_windows(data):
+    """
+       Longitudinal and lateral acceleration over the time window of every fix. The window of a fix ends at the
+       first fix at least EVENT_WINDOW seconds later, which smooths out the jitter of fast loggers.
+
+       :param :
+        data: input_data
+
+       :return:
+        window_end: index of the fix ending the window of each of the first len(window_end) fixes
+        acceleration: change of speed in m/s^2, negative when braking
+        lateral: absolute heading rate times mean speed in m/s^2
+    """
+    time = data["time"]
+    speed = data["speed"] * KNOTS_TO_MS
+    window_end = window_ends(time, EVENT_WINDOW)
+    count = len(window_end)
+    elapsed = time[window_end] - time[:count]
+
+    acceleration = (speed[window_end] - speed[:count]) / elapsed
+
+    turn = data["heading"][window_end] - data["heading"][:count]
+    turn += 180
+    np.mod(turn, 360, out=turn)
+    turn -= 180
+    lateral = np.abs(np.radians(turn)) / elapsed * (speed[window_end] + speed[:count]) / 2
+
+    return window_end, acceleration, lateral
+
+def event_runs(data, window_end, active, value, kind):
+    """
+       Merge runs of consecutive active windows into events
+
+       :param :
+        data: input_data
+        window_end: index of the fix ending the window of each fix
+        active: boolean mask of active windows
+        value: value of every window, the largest value of a run is its peak
+        kind: index into EVENT_KINDS
+
+       :return:
+        events: events containing one array per column in EVENT_COLUMNS
+    """
+    time = data["time"]
+
+    # Find start and end of every run of active windows
+    edges = np.diff(active.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return {column: np.empty(0, dtype=np.int8 if column == "kind" else np.float64) for column in EVENT_COLUMNS}
+
+    # Inactive windows are zeroed so that each reduction only sees the windows of its own run
+    peak = np.maximum.reduceat(np.where(active, value, 0), starts)
+    # Run from its first window start to its last window end
+    start_time = time[starts]
+    end_time = time[window_end[ends - 1]]
+
+    return {"start": start_time, "end": end_time, "duration": np.round(end_time - start_time, 3),
+            "lat": data["lat"][starts], "lon": data["lon"][starts],
+            "kind": np.full(len(starts), kind, dtype=np.int8), "peak": peak}
+
+def check_events(data):
     """
-       Emit kml file header
+       Check for driving events: hard acceleration and braking from the change of speed, harsh cornering from the
+       heading rate, and speeding above SPEED_LIMIT. Every check is a single pass of array operations over the trip.
+
+       :param :
+        data: input_data
+
+       :return:
+        event_list: events containing one array per column in EVENT_COLUMNS, ordered by start time
+    """
+    window_end, acceleration, lateral = event_windows(data)
+    speed = data["speed"]
+    # Speeding is measured between consecutive fixes
+    pair_end = np.arange(1, len(speed))
+
+    parts = [event_runs(data, window_end, acceleration > ACCEL_LIMIT, acceleration,
+                        EVENT_KINDS.index("acceleration")),
+             event_runs(data, window_end, acceleration < -BRAKE_LIMIT, -acceleration, EVENT_KINDS.index("braking")),
+             event_runs(data, window_end, lateral > CORNER_LIMIT, lateral, EVENT_KINDS.index("cornering")),
+             event_runs(data, pair_end, speed[:-1] > SPEED_LIMIT, speed[:-1], EVENT_KINDS.index("speeding"))]
+
+    order = np.argsort(np.concatenate([part["start"] for part in parts]), kind="stable")
+    event_list = {column: np.concatenate([part[column] for part in parts])[order] for column in EVENT_COLUMNS}
+
+    return event_list
+
+def write_kmlfile_header(file_name, kmz=False):
+    """
+       Emit kml file header. The kml is written through a large buffer, and with kmz set it is streamed
+       straight into a deflated doc.kml entry of a .kmz archive.
 
        :param :
         file_name: file name of kml file to be written
+        kmz: write a zipped .kmz instead of a plain .kml
 
        :return:
         data: written file
 
     """
-    file_arr = file_name.split(".")
-    file = open(file_arr[0]+".kml", "w+")
+    base_name = os.path.splitext(file_name)[0]
+    if kmz:
+        archive = zipfile.ZipFile(base_name+".kmz", "w", zipfile.ZIP_DEFLATED)
+        entry = io.BufferedWriter(archive.open("doc.kml", "w", force_zip64=True), KML_BUFFER_SIZE)
+        file = io.TextIOWrapper(entry, encoding="utf-8")
+        # Archive is closed together with the file by write_kmlfile_trailer
+        file.archive = archive
+    else:
+        file = open(base_name+".kml", "w", encoding="utf-8", buffering=KML_BUFFER_SIZE)
     str = '<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns = "http://www.opengis.net/kml/2.2">\n\
         <Document>\n\
         <Style id="yellowPoly">\n\
@@ -233,13 +529,24 @@ def write_kmlfile_header(file_name):
                 <color>7f00ff00</color>\n\
             </PolyStyle>\n\
         </Style>\n\
-        <Placemark><styleUrl>#yellowPoly</styleUrl>\n\
-        <LineString>\n\
-        <Description>Speed in MPH, not altitude.</Description>\n\
-        <extrude> 1 </extrude>\n\
-        <tesselate> 1 </tesselate>\n\
-        <altitudeMode> clamp to ground </altitudeMode>\n\
-        <coordinates>'
+        <Style id="stopPlacemark">\n\
+            <IconStyle>\n\
+                <color>ff0000ff</color>\n\
+                <Icon>\n\
+                    <href>http://maps.google.com/mapfiles/kml/paddle/1.png</href>\n\
+                </Icon>\n\
+            </IconStyle>\n\
+        </Style>\n'
+    # One icon style per driving event layer
+    for kind, color in zip(EVENT_KINDS, EVENT_COLORS):
+        str += '        <Style id="'+kind+'Placemark">\n\
+            <IconStyle>\n\
+                <color>'+color+'</color>\n\
+                <Icon>\n\
+                    <href>http://maps.google.com/mapfiles/kml/shapes/caution.png</href>\n\
+                </Icon>\n\
+            </IconStyle>\n\
+        </Style>\n'
 
     file.write(str)
 
@@ -252,48 +559,65 @@ def write_kmlfile_body(file, data):
 
        :param :
         file: file to be written
-        data: turn data
+        data: latitude and longitude data
 
        :return:
         data: written file
 
     """
-
-    for val in data:
-        file.write(str(val[1])+",")
-        file.write(str(val[0])+"\n")
+    file.write("""        <Placemark><styleUrl>#yellowPoly</styleUrl>
+        <LineString>
+        <Description>Speed in MPH, not altitude.</Description>
+        <extrude> 1 </extrude>
+        <tesselate> 1 </tesselate>
+        <altitudeMode> clamp to ground </altitudeMode>
+        <coordinates>""")
+
+    # Format points a chunk at a time to bound memory
+    for idx in range(0, len(data), KML_CHUNK_SIZE):
+        chunk = data[idx:idx+KML_CHUNK_SIZE].tolist()
+        file.write("".join([repr(lon)+","+repr(lat)+"\n" for lat, lon in chunk]))
+
+    file.write("""        </coordinates>
+        </LineString>
+        </Placemark>
+""")
 
     return file
 
+def write_kml_placemark(file, lat, lon, description, style=None):
+    """
+       Emit a single point placemark
+
+       :param :
+        file: file to be written
+        lat: latitude in decimal degrees
+        lon: longitude in decimal degrees
+        description: placemark description
+        style: optional id of a shared style from the header
+
+       :return:
+        None
+    """
+    style_url = "<styleUrl>#"+style+"</styleUrl>" if style else ""
+    file.write("<Placemark><description>"+description+"</description>"+style_url+
+               "<Point><coordinates>"+repr(lon)+","+repr(lat)+"</coordinates></Point></Placemark>\n")
+
 def write_kmlfile_body_turn(file, data):
     """
        Emit kml file body for turns
 
        :param :
         file: file to be written
-        data: turn data
+        data: turn data from check_turns
 
        :return:
         data: written file
 
     """
-    string = """
-                            </coordinates>   
-                        </LineString>  
-                    </Placemark> 
-           """
-    file.write(string)
-    string = ""
-    for val in data:
-        string += """<Placemark>
-                <description>Default Pin is Yellow</description>
-                <Point><coordinates>"""
-        string += (str(val[1])+",")
-        string += (str(val[0])+"\n")
-        string += """</coordinates></Point>
-                </Placemark>"""
-
-        file.write(string)
+    for lat, lon, angle, kind in zip(data["lat"].tolist(), data["lon"].tolist(), data["angle"].tolist(),
+                                     data["kind"].tolist()):
+        write_kml_placemark(file, lat, lon, TURN_LABELS[kind]+" of "+str(round(abs(angle)))+" degrees")
 
     return file
 
@@ -304,38 +628,44 @@ def write_kmlfile_body_stop(file, data):
 
        :param :
         file: file to be written
-        data: stop data
+        data: stop data from check_stop
 
        :return:
         data: written file
 
     """
+    for lat, lon, duration in zip(data["lat"].tolist(), data["lon"].tolist(), data["duration"].tolist()):
+        write_kml_placemark(file, lat, lon, "Red PIN for A Stop of "+str(duration)+" secs", "stopPlacemark")
 
-    string = ""
-    for val in data:
-        string += """<Placemark>
-        <description>Red PINfor A Stop</description>
-        <Style id="normalPlacemark">
-        <IconStyle>
-        <color>ff0000ff</color>
-        <Icon>
-        <href>http://maps.google.com/mapfiles/kml/paddle/1.png</href>
-        </Icon>
-        </IconStyle>
-        </Style>
-        <Point><coordinates>"""
-        string += (str(val[1])+",")
-        string += (str(val[0])+"\n")
-        string += """</coordinates></Point>
-                </Placemark>"""
+    return file
 
-        file.write(string)
+def write_kmlfile_body_events(file, data):
+    """
+       Emit kml file body for driving events, one folder per kind of event
+
+       :param :
+        file: file to be written
+        data: event data from check_events
+
+       :return:
+        data: written file
+
+    """
+    for kind, name in enumerate(EVENT_KINDS):
+        found = data["kind"] == kind
+        unit = " knots" if name == "speeding" else " m/s2"
+        file.write("<Folder><name>"+name+"</name>\n")
+        for lat, lon, duration, peak in zip(data["lat"][found].tolist(), data["lon"][found].tolist(),
+                                            data["duration"][found].tolist(), data["peak"][found].tolist()):
+            write_kml_placemark(file, lat, lon, name+" peaking at "+str(round(peak, 2))+unit+" for "+str(duration)+
+                                " secs", name+"Placemark")
+        file.write("</Folder>\n")
 
     return file
 
 def write_kmlfile_trailer(file):
     """
-       Emit kml file trailer
+       Emit kml file trailer and close the file
 
        :param :
         file: file to be written
@@ -345,12 +675,11 @@ def write_kmlfile_trailer(file):
 
     """
 
-    str = """      
-            </Document>
-        </kml>
-        """
-
-    file.write(str)
+    file.write(KML_TRAILER)
+    file.close()
+    archive = getattr(file, "archive", None)
+    if archive is not None:
+        archive.close()
 
     return file
 
@@ -362,102 +691,394 @@ def process_directions(data):
         data: extracted data
 
        :return:
-        directions: latitude and longitude
-    """
-    directions = []
-
-    for val in data:
-        temp= []
-        # Get latitude
-        lat = val[1]
-        # Get longitude
-        long = val[3]
-        # Get north/south
-        north_south = val[2]
-        # Get east/west
-        east_west = val[4]
-
-        lat_minsarr = lat.split(".")
-        # Get latitude mins
-        lat_mins = lat_minsarr[0][-2:]
-        # Get latitude degrees
-        lat_degrees = float(lat_minsarr[0][0:len(lat_minsarr[0])-2])
-        lat_mins += "."+lat_minsarr[1]
-        # Get latitude hours
-        lat_hours = float(lat_mins)/60
-        lat_degrees+= lat_hours
-        if(north_south == 'S'):
-            # If direction is South multiply by -1
-            lat_degrees = -1 * lat_degrees;
-
-        # Append latitude
-        temp.append(lat_degrees)
-
-        long_minsarr = long.split(".")
-        # Get longitude mins
-        long_mins = long_minsarr[0][-2:]
-        # Get longitude degrees
-        long_degrees = float(long_minsarr[0][0:len(long_minsarr[0])-2])
-        long_mins += "." + long_minsarr[1]
-        # Get longitude hours
-        long_hours = float(long_mins) / 60
-        long_degrees += long_hours
-        if (east_west == 'W'):
-            # If direction is West multiply by -1
-            long_degrees = -1 * long_degrees;
-
-        # Append longitude
-        temp.append(long_degrees)
-        # Add latitude and longitude to directions
-        directions.append(temp)
+        directions: float64 array of shape (n, 2) holding latitude and longitude
+    """
+    directions = np.column_stack((data["lat"], data["lon"]))
 
     return directions
 
+def local_metres(directions):
+    """
+       Project latitude and longitude onto a local plane in metres
+
+       :param :
+        directions: float64 array of shape (n, 2) holding latitude and longitude
+
+       :return:
+        points: float64 array of shape (n, 2) holding x (east) and y (north) in metres
+    """
+    scale = EARTH_RADIUS_KM * 1000 * math.pi / 180
+    # Equirectangular projection around the mean latitude
+    lat0 = math.radians(float(directions[:, 0].mean())) if len(directions) else 0.0
+    points = np.empty_like(directions)
+    points[:, 0] = directions[:, 1] * (scale * math.cos(lat0))
+    points[:, 1] = directions[:, 0] * scale
+
+    return points
+
+def douglas_peucker(points, tolerance):
+    """
+       Iterative Douglas-Peucker line simplification using an explicit stack of spans
+
+       :param :
+        points: float64 array of shape (n, 2) in metres
+        tolerance: maximum distance in metres of a dropped point from the simplified line
+
+       :return:
+        keep: boolean mask of points kept
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start = points[first]
+        segment = points[last] - start
+        inner = points[first+1:last] - start
+        length = segment @ segment
+        # Distance of every inner point to the segment from first to last
+        if length > 0:
+            along = np.clip(inner @ segment / length, 0, 1)
+            inner -= along[:, None] * segment
+        dist = np.einsum("ij,ij->i", inner, inner)
+        farthest = int(np.argmax(dist))
+        if dist[farthest] > tolerance * tolerance:
+            mid = first + 1 + farthest
+            keep[mid] = True
+            stack.append((first, mid))
+            stack.append((mid, last))
+
+    return keep
+
+def simplify_directions(directions, tolerance=SIMPLIFY_TOLERANCE):
+    """
+       Simplify a track before kml emission. Consecutive points falling in the same grid cell of half the
+       tolerance are collapsed to one, which removes stationary runs, then Douglas-Peucker drops every point
+       within tolerance of the simplified line.
+
+       :param :
+        directions: float64 array of shape (n, 2) holding latitude and longitude
+        tolerance: simplification tolerance in metres
+
+       :return:
+        directions: simplified float64 array of shape (m, 2) holding latitude and longitude
+    """
+    if len(directions) < 3:
+        return directions
+
+    points = local_metres(directions)
+    # Collapse runs of consecutive points in the same cell
+    cells = np.floor(points / (tolerance / 2))
+    moved = np.empty(len(points), dtype=bool)
+    moved[0] = True
+    np.any(cells[1:] != cells[:-1], axis=1, out=moved[1:])
+    moved[-1] = True
+    idx = np.flatnonzero(moved)
+
+    keep = douglas_peucker(points[idx], tolerance)
+
+    return directions[idx[keep]]
+
+def nmea_checksum_ok(sentence):
+    """
+       Verify the *XX checksum of an NMEA sentence
+
+       :param :
+        sentence: raw sentence bytes starting with $
+
+       :return:
+        valid: True if the checksum is present and matches
+    """
+    star = sentence.rfind(b"*")
+    if star < 0:
+        return False
+    try:
+        expected = int(sentence[star+1:star+3], 16)
+    except ValueError:
+        return False
+    # XOR of every byte between $ and *
+    return functools.reduce(operator.xor, sentence[1:star], 0) == expected
+
+def ddmm_to_degrees(lat, north_south, lon, east_west):
+    """
+       Convert DDMM.MMMM latitude and longitude columns to signed decimal degrees in one pass
+
+       :param :
+        lat: float array of latitudes in degrees and minutes
+        north_south: S1 array of N/S hemispheres
+        lon: float array of longitudes in degrees and minutes
+        east_west: S1 array of E/W hemispheres
+
+       :return:
+        directions: float64 array of shape (n, 2) holding latitude and longitude
+    """
+    directions = np.column_stack((lat, lon))
+    # Split degrees from minutes and convert minutes to fractional degrees
+    degrees = np.floor(directions / 100)
+    directions -= degrees * 100
+    directions /= 60
+    directions += degrees
+    # South and West are negative
+    directions[north_south == b"S", 0] *= -1
+    directions[east_west == b"W", 1] *= -1
+
+    return directions
+
+def new_batch(batch_size):
+    """
+       Allocate an empty batch of raw fixes
+
+       :param :
+        batch_size: Number of fixes in the batch
+
+       :return:
+        batch: dictionary of FIX_COLUMNS float64 arrays plus S1 hemisphere arrays
+    """
+    batch = {column: np.empty(batch_size) for column in FIX_COLUMNS}
+    batch["north_south"] = np.empty(batch_size, dtype="S1")
+    batch["east_west"] = np.empty(batch_size, dtype="S1")
+
+    return batch
+
+def finish_batch(batch, count):
+    """
+       Trim a raw batch and convert its coordinates to decimal degrees
+
+       :param :
+        batch: raw batch from new_batch
+        count: number of filled fixes
+
+       :return:
+        batch: dictionary of float64 arrays keyed by FIX_COLUMNS
+    """
+    directions = ddmm_to_degrees(batch["lat"][:count], batch["north_south"][:count],
+                                 batch["lon"][:count], batch["east_west"][:count])
+    # One contiguous block holding the latitude row and the longitude row
+    lat, lon = np.ascontiguousarray(directions.T)
+
+    return {"time": batch["time"][:count], "lat": lat, "lon": lon,
+            "speed": batch["speed"][:count], "heading": batch["heading"][:count]}
+
+def read_fixes(file, batch_size=65536):
+    """
+       Stream valid $GPRMC fixes from an NMEA log as typed columnar batches
+
+       :param :
+        file: Input NMEA txt file
+        batch_size: Number of fixes per batch
+
+       :return:
+        batch: dictionary of float64 arrays keyed by FIX_COLUMNS
+    """
+    # open file
+    with open(file, "rb") as f:
+        yield from parse_sentences(f, batch_size)
+
+def parse_sentences(lines, batch_size=65536, day_start=None):
+    """
+       Parse valid $GPRMC fixes from NMEA sentences into typed columnar batches. Sentences with a missing or bad
+       checksum, void fixes and malformed fields are skipped.
+
+       :param :
+        lines: iterable of raw sentence bytes
+        batch_size: Number of fixes per batch
+        day_start: optional dictionary caching epoch seconds at midnight of each ddmmyy date, kept by callers
+                   that parse one stream in several calls
+
+       :return:
+        batch: dictionary of float64 arrays keyed by FIX_COLUMNS
+    """
+    if day_start is None:
+        day_start = {}
+    batch = new_batch(batch_size)
+    count = 0
+
+    for line in lines:
+        # Choose only records having $GPRMC with a valid checksum
+        if not line.startswith(b"$GPRMC") or not nmea_checksum_ok(line):
+            continue
+        row = line[:line.rfind(b"*")].split(b",")
+        # Choose only records which are active
+        if len(row) < 10 or row[2] != b"A":
+            continue
+        try:
+            date = row[9]
+            if date not in day_start:
+                day_start[date] = calendar.timegm((2000 + int(date[4:6]), int(date[2:4]), int(date[0:2]),
+                                                   0, 0, 0))
+            utc = row[1]
+            time = day_start[date] + int(utc[0:2]) * 3600 + int(utc[2:4]) * 60 + float(utc[4:])
+            lat = float(row[3])
+            lon = float(row[5])
+            speed = float(row[7])
+            heading = float(row[8])
+        except ValueError:
+            continue
+
+        batch["time"][count] = time
+        batch["lat"][count] = lat
+        batch["north_south"][count] = row[4]
+        batch["lon"][count] = lon
+        batch["east_west"][count] = row[6]
+        batch["speed"][count] = speed
+        batch["heading"][count] = heading
+        count += 1
+
+        # Hand over a full batch and start a new one
+        if count == batch_size:
+            yield finish_batch(batch, count)
+            batch = new_batch(batch_size)
+            count = 0
+
+    if count:
+        yield finish_batch(batch, count)
+
 def preprocess(file):
     """
        Preprocess input file data
 
        :param :
-        file: Input csv file
+        file: Input NMEA txt file
 
        :return:
-        data: extracted data
+        data: trip containing one float64 array per column in FIX_COLUMNS
 
     """
-    extracted_data = []
+    batches = list(read_fixes(file))
+    if not batches:
+        return {column: np.empty(0) for column in FIX_COLUMNS}
 
-    # open file
-    with open(file, encoding="utf-8") as f:
-        # Skip first five header line
-        next(f)
-        next(f)
-        next(f)
-        next(f)
-        next(f)
-        # read csv data file
-        csv_readfile = csv.reader(f, delimiter=',')
-        for row in csv_readfile:
-            # Choose only records having $GPRMC and which are active
-            if row[0]=='$GPRMC' and row[2]=='A':
-                data = []
-                # Append time
-                data.append(row[1])
-                # Append latitude
-                data.append(row[3])
-                # Append N/S
-                data.append(row[4])
-                # Append longitude
-                data.append(row[5])
-                # Append E/W
-                data.append(row[6])
-                # Append speed
-                data.append(row[7])
-                # Append angle
-                data.append(row[8])
-
-                extracted_data.append(data)
-
-    return extracted_data
+    data = {column: np.concatenate([batch[column] for batch in batches]) for column in FIX_COLUMNS}
+
+    return data
+
+def trip_cache_path(file, cache_dir):
+    """
+       Cache entry directory of a trip, keyed by its absolute source path
+
+       :param :
+        file: Input NMEA txt file
+        cache_dir: directory of the parsed trip cache
+
+       :return:
+        entry: cache entry directory
+    """
+    key = hashlib.blake2b(os.path.abspath(file).encode("utf-8"), digest_size=16).hexdigest()
+
+    return os.path.join(cache_dir, key)
+
+def file_digest(file):
+    """
+       Content hash of a file
+
+       :param :
+        file: file to be hashed
+
+       :return:
+        digest: hex digest of the file content
+    """
+    digest = hashlib.blake2b()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def map_trip(entry):
+    """
+       Memory map the columns of a cached trip
+
+       :param :
+        entry: cache entry directory
+
+       :return:
+        data: trip containing one read-only memory mapped array per column in FIX_COLUMNS
+    """
+    return {column: np.load(os.path.join(entry, column+".npy"), mmap_mode="r") for column in FIX_COLUMNS}
+
+def save_trip(entry, data, meta):
+    """
+       Write a trip into the cache. The entry is built in a temporary directory and moved into place so readers
+       never see a partial entry.
+
+       :param :
+        entry: cache entry directory
+        data: trip containing one array per column in FIX_COLUMNS
+        meta: dictionary describing the source file
+
+       :return:
+        None
+    """
+    tmp_entry = entry+".tmp"+str(os.getpid())
+    os.makedirs(tmp_entry, exist_ok=True)
+    for column in FIX_COLUMNS:
+        np.save(os.path.join(tmp_entry, column+".npy"), data[column])
+    write_cache_meta(tmp_entry, meta)
+
+    if os.path.isdir(entry):
+        shutil.rmtree(entry)
+    os.replace(tmp_entry, entry)
+
+def write_cache_meta(entry, meta):
+    """
+       Write the metadata of a cache entry
+
+       :param :
+        entry: cache entry directory
+        meta: dictionary describing the source file
+
+       :return:
+        None
+    """
+    with open(os.path.join(entry, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+def load_trip(file, cache_dir=CACHE_DIR):
+    """
+       Load a trip from the parsed trip cache, parsing and caching it on a miss. An entry is reused when the source
+       size and mtime are unchanged, or when only the mtime changed but the content hash still matches.
+
+       :param :
+        file: Input NMEA txt file
+        cache_dir: directory of the parsed trip cache, None to always parse
+
+       :return:
+        data: trip containing one array per column in FIX_COLUMNS
+    """
+    if cache_dir is None:
+        return preprocess(file)
+
+    entry = trip_cache_path(file, cache_dir)
+    stat = os.stat(file)
+    try:
+        with open(os.path.join(entry, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+
+    digest = None
+    if meta.get("version") == CACHE_VERSION and meta.get("size") == stat.st_size:
+        if meta.get("mtime_ns") == stat.st_mtime_ns:
+            return map_trip(entry)
+        digest = file_digest(file)
+        if meta.get("hash") == digest:
+            # Touched but unchanged, remember the new mtime
+            meta["mtime_ns"] = stat.st_mtime_ns
+            write_cache_meta(entry, meta)
+            return map_trip(entry)
+
+    if digest is None:
+        digest = file_digest(file)
+    data = preprocess(file)
+    save_trip(entry, data, {"version": CACHE_VERSION, "path": os.path.abspath(file), "size": stat.st_size,
+                            "mtime_ns": stat.st_mtime_ns, "hash": digest})
+
+    return data
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
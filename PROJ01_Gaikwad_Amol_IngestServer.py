@@ -0,0 +1,334 @@
+"""
+Author: Amol Gaikwad
+
+Asyncio ingestion server for NMEA streams from many devices at once. Every TCP connection starts with a
+"DEVICE <id>" line followed by raw NMEA sentences. Each device keeps its own live trip state for cost, turns and
+stops, and its kml is brought up to date periodically by reopening it, so idle devices hold no file or write
+buffer. A device is dropped once its last connection ends, and a device that comes back starts a new kml. The
+simulate command replays the bundled ZI*.txt logs as any number of devices at N times real speed to load the
+server.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import os
+import re
+import sys
+import glob
+import time
+import asyncio
+import numpy as np
+import PROJ01_Gaikwad_Amol_GPSVisualization as gps
+import PROJ01_Gaikwad_Amol_LiveTail as live
+
+# Default TCP port of the server
+INGEST_PORT = 10110
+# Default address the server listens on, the server has no authentication so it only serves this machine
+INGEST_HOST = "127.0.0.1"
+# Seconds between kml flushes and status lines
+FLUSH_INTERVAL = 5.0
+# Number of bytes read from a connection at a time
+READ_SIZE = 65536
+# Number of received bytes buffered per device before they are parsed, so that the vectorized turn and stop
+# detection runs on many fixes at once instead of a few per packet
+PROCESS_SIZE = 65536
+
+def main():
+    """
+        Main Program
+        Handle command line arguments.
+
+        :param : Command line arguments
+        :argv[1]: serve or simulate
+        :argv[2:]: serve [port] [output directory] [host] | simulate [port] [speed] [devices]
+
+        :return: None
+    """
+    # Read number of arguments
+    noofargs = len(sys.argv)
+
+    if noofargs >= 2 and sys.argv[1] == "serve" and noofargs <= 5:
+        port = int(sys.argv[2]) if noofargs >= 3 else INGEST_PORT
+        out_dir = sys.argv[3] if noofargs >= 4 else "devices"
+        host = sys.argv[4] if noofargs == 5 else INGEST_HOST
+        try:
+            asyncio.run(serve(port, out_dir, host))
+        except KeyboardInterrupt:
+            pass
+    elif noofargs >= 2 and sys.argv[1] == "simulate" and noofargs <= 5:
+        port = int(sys.argv[2]) if noofargs >= 3 else INGEST_PORT
+        speed = float(sys.argv[3]) if noofargs >= 4 else 1.0
+        devices = int(sys.argv[4]) if noofargs == 5 else 8
+        files = sorted(glob.glob("ZI*.txt"))
+        asyncio.run(simulate(INGEST_HOST, port, files, speed, devices))
+    else:
+        print("Invalid number of arguments")
+
+def new_device(device_id, out_dir):
+    """
+       State of one device
+
+       :param :
+        device_id: device id
+        out_dir: directory of the per-device kml files
+
+       :return:
+        device: dictionary holding the live trip state, received bytes, pending updates and the name of its kml
+                with the position of its trailer
+    """
+    name = os.path.join(out_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", device_id))
+    # Keep the kml of an earlier trip of the same device
+    trip = 1
+    while os.path.exists(name + ("_" + str(trip) if trip > 1 else "") + ".kml"):
+        trip += 1
+    if trip > 1:
+        name += "_" + str(trip)
+    writer = live.open_live_kml(name + ".txt")
+    writer["file"].close()
+
+    return {"id": device_id, "live": live.new_live_state(), "received": [], "received_size": 0, "pending": [],
+            "connections": 0, "kml": {"name": writer["file"].name, "pos": writer["pos"]}}
+
+def receive(device, chunk):
+    """
+       Buffer received bytes of a device and parse them once enough have arrived
+
+       :param :
+        device: device state
+        chunk: received bytes
+
+       :return:
+        None
+    """
+    device["received"].append(chunk)
+    device["received_size"] += len(chunk)
+    if device["received_size"] >= PROCESS_SIZE:
+        process_device(device)
+
+def process_device(device):
+    """
+       Parse the buffered bytes of a device into its live trip
+
+       :param :
+        device: device state
+
+       :return:
+        None
+    """
+    if device["received"]:
+        device["pending"].append(live.feed_bytes(device["live"], b"".join(device["received"])))
+        device["received"] = []
+        device["received_size"] = 0
+
+def merge_updates(updates):
+    """
+       Merge consecutive live updates into one
+
+       :param :
+        updates: list of updates from live.feed_fixes or live.finish_live_state
+
+       :return:
+        update: single update holding all track points, turns and stops
+    """
+    return {"track": np.concatenate([update["track"] for update in updates]),
+            "turns": {column: np.concatenate([update["turns"][column] for update in updates])
+                      for column in gps.TURN_COLUMNS},
+            "stops": {column: np.concatenate([update["stops"][column] for update in updates])
+                      for column in gps.STOP_COLUMNS}}
+
+def flush_device(device):
+    """
+       Write the pending updates of a device to its kml, open only while writing
+
+       :param :
+        device: device state
+
+       :return:
+        None
+    """
+    if device["pending"]:
+        kml = device["kml"]
+        with open(kml["name"], "r+", encoding="utf-8") as file:
+            writer = {"file": file, "pos": kml["pos"]}
+            live.append_live_kml(writer, merge_updates(device["pending"]))
+        kml["pos"] = writer["pos"]
+        device["pending"] = []
+
+async def handle_device(reader, writer, devices, out_dir):
+    """
+       Ingest the NMEA stream of one connection
+
+       :param :
+        reader: stream reader of the connection
+        writer: stream writer of the connection
+        devices: dictionary of device id to device state
+        out_dir: directory of the per-device kml files
+
+       :return:
+        None
+    """
+    peer = writer.get_extra_info("peername")
+    device = None
+    try:
+        hello = await reader.readline()
+        if hello.startswith(b"DEVICE "):
+            device_id = hello[7:].strip().decode("ascii", "replace")
+            chunk = b""
+        else:
+            # No hello line, name the device after its peer and keep the line as data
+            device_id = str(peer[0])+"_"+str(peer[1])
+            chunk = hello
+
+        if device_id not in devices:
+            devices[device_id] = new_device(device_id, out_dir)
+        device = devices[device_id]
+        device["connections"] += 1
+
+        while True:
+            if chunk:
+                receive(device, chunk)
+            chunk = await reader.read(READ_SIZE)
+            if not chunk:
+                break
+    except (ConnectionError, ValueError) as error:
+        # Dropped connection or a hello line over the stream limit
+        print("Connection from " + str(peer) + " closed: " + repr(error), flush=True)
+    finally:
+        writer.close()
+
+    if device is None:
+        return
+    device["connections"] -= 1
+    process_device(device)
+    if device["connections"] == 0:
+        # Trip is over once its last connection is gone, a last sentence without a newline is parsed as well
+        device["pending"].append(live.finish_live_state(device["live"]))
+        flush_device(device)
+        del devices[device["id"]]
+    elif device["live"]["partial"]:
+        # End the sentence this connection left unfinished so that it does not run into the next one
+        device["pending"].append(live.feed_bytes(device["live"], b"\n"))
+
+async def flush_periodically(devices):
+    """
+       Flush the kml of every connected device and print a status line every FLUSH_INTERVAL seconds
+
+       :param :
+        devices: dictionary of device id to device state
+
+       :return:
+        None
+    """
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        for device in devices.values():
+            process_device(device)
+            flush_device(device)
+        fixes = sum(device["live"]["fixes"] for device in devices.values())
+        print("Devices " + str(len(devices)) + " fixes " + str(fixes), flush=True)
+
+async def serve(port, out_dir, host=INGEST_HOST):
+    """
+       Run the ingestion server until cancelled
+
+       :param :
+        port: TCP port to listen on
+        out_dir: directory of the per-device kml files
+        host: address to listen on, "0.0.0.0" lets any machine on the network write trips
+
+       :return:
+        None
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    devices = {}
+    server = await asyncio.start_server(lambda reader, writer: handle_device(reader, writer, devices, out_dir),
+                                        host, port)
+    flusher = asyncio.ensure_future(flush_periodically(devices))
+    print("Listening on " + host + " port " + str(port), flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        flusher.cancel()
+        for device in devices.values():
+            process_device(device)
+            flush_device(device)
+
+def sentence_time(line):
+    """
+       Seconds since midnight of an NMEA sentence
+
+       :param :
+        line: raw sentence bytes
+
+       :return:
+        seconds: seconds since midnight, None for lines without a time
+    """
+    fields = line.split(b",", 2)
+    if len(fields) < 2 or len(fields[1]) < 6:
+        return None
+    utc = fields[1]
+    try:
+        return int(utc[0:2]) * 3600 + int(utc[2:4]) * 60 + float(utc[4:])
+    except ValueError:
+        return None
+
+async def replay(host, port, device_id, file, speed):
+    """
+       Replay an NMEA log as one device at speed times real time
+
+       :param :
+        host: server host
+        port: server port
+        device_id: device id to announce
+        file: NMEA txt file to be replayed
+        speed: replay speed factor
+
+       :return:
+        None
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b"DEVICE " + device_id.encode("ascii") + b"\n")
+    start = time.monotonic()
+    first = None
+    pending = []
+
+    with open(file, "rb") as f:
+        for line in f:
+            seconds = sentence_time(line)
+            if seconds is not None:
+                if first is None:
+                    first = seconds
+                # Wait until this sentence is due, sending everything before it in one write
+                delay = (seconds - first) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    writer.write(b"".join(pending))
+                    pending = []
+                    await writer.drain()
+                    await asyncio.sleep(delay)
+            pending.append(line)
+
+    writer.write(b"".join(pending))
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+async def simulate(host, port, files, speed, devices):
+    """
+       Replay logs as many simultaneous devices
+
+       :param :
+        host: server host
+        port: server port
+        files: NMEA txt files to be replayed, reused round robin
+        speed: replay speed factor
+        devices: number of simulated devices
+
+       :return:
+        None
+    """
+    await asyncio.gather(*[replay(host, port, "sim"+str(idx)+"_"+os.path.splitext(os.path.basename(
+        files[idx % len(files)]))[0], files[idx % len(files)], speed) for idx in range(devices)])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+"""
+Author: Amol Gaikwad
+
+Live follow mode for a growing NMEA log. Only newly appended bytes are parsed. The running cost is updated from
+the new fixes, and turns and stops are detected on a short buffer of recent fixes. The buffer is cut at the latest
+fix that is neither inside a turning window nor part of a stationary pair, so every turn and stop before the cut
+is final and is flushed to the kml exactly once. While the vehicle stays stopped only the start of the stop and
+the latest fix are kept, so a long stop does not grow the buffer.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import sys
+import math
+import time
+import numpy as np
+import PROJ01_Gaikwad_Amol_GPSVisualization as gps
+
+# Number of bytes read from the log at a time
+TAIL_READ_SIZE = 1 << 20
+
+def main():
+    """
+        Main Program
+        Handle command line arguments.
+
+        :param : Command line arguments
+        :argv[1]: NMEA txt file to be followed
+        :argv[2]: Optional poll interval in seconds
+        :argv[3]: Optional number of idle seconds after which to stop following
+
+        :return: None
+    """
+    # Read number of arguments
+    noofargs = len(sys.argv)
+
+    # Check for invalid number of arguments
+    if noofargs < 2 or noofargs > 4:
+        print("Invalid number of arguments")
+    else:
+        poll_interval = float(sys.argv[2]) if noofargs >= 3 else 1.0
+        idle_timeout = float(sys.argv[3]) if noofargs == 4 else None
+        state = follow(sys.argv[1], poll_interval, idle_timeout)
+        print("Final cost " + str(live_cost(state)))
+
+def empty_trip():
+    """
+       Trip without any fixes
+
+       :param : None
+
+       :return:
+        data: trip containing one empty array per column in gps.FIX_COLUMNS
+    """
+    return {column: np.empty(0) for column in gps.FIX_COLUMNS}
+
+def new_live_state():
+    """
+       Incremental state of one live trip
+
+       :param : None
+
+       :return:
+        state: dictionary holding the recent fix buffer, the stop still open before it, parser state and running
+               cost inputs
+    """
+    return {"buffer": empty_trip(), "open_stop": None, "day_start": {}, "partial": b"", "first_time": None,
+            "last_time": -math.inf, "max_speed": -math.inf, "last_point": None, "fixes": 0, "turns": 0,
+            "stops": 0}
+
+def live_cost(state):
+    """
+       Running cost of a live trip
+
+       :param :
+        state: live trip state
+
+       :return:
+        cost: cost of the fixes seen so far, infinity before the first fix
+    """
+    if state["first_time"] is None:
+        return math.inf
+
+    return gps.cost_function((state["last_time"] - state["first_time"]) / 60, state["max_speed"])
+
+def feed_bytes(state, chunk):
+    """
+       Parse newly received bytes of an NMEA stream and update the live trip. A trailing partial sentence is kept
+       until the rest of it arrives.
+
+       :param :
+        state: live trip state
+        chunk: newly received bytes
+
+       :return:
+        update: new track points, final turns and final stops
+    """
+    lines = (state["partial"] + chunk).split(b"\n")
+    state["partial"] = lines.pop()
+    batches = list(gps.parse_sentences(lines, day_start=state["day_start"]))
+    if not batches:
+        return feed_fixes(state, empty_trip())
+
+    return feed_fixes(state, {column: np.concatenate([batch[column] for batch in batches])
+                              for column in gps.FIX_COLUMNS})
+
+def feed_fixes(state, fixes):
+    """
+       Add new fixes to a live trip and finalize every turn and stop that can no longer change
+
+       :param :
+        state: live trip state
+        fixes: new fixes containing one array per column in gps.FIX_COLUMNS
+
+       :return:
+        update: dictionary with the new track points, final turns and final stops
+    """
+    # Drop fixes going back in time so the buffer stays sorted
+    time = fixes["time"]
+    forward = time > np.maximum.accumulate(np.concatenate(([state["last_time"]], time)))[:-1]
+    if not forward.all():
+        fixes = {column: fixes[column][forward] for column in gps.FIX_COLUMNS}
+
+    track = gps.process_directions(fixes)
+    if len(track):
+        # Update running cost inputs
+        if state["first_time"] is None:
+            state["first_time"] = float(fixes["time"][0])
+        state["last_time"] = float(fixes["time"][-1])
+        state["max_speed"] = max(state["max_speed"], float(fixes["speed"].max()))
+        state["fixes"] += len(track)
+        # Continue the track from the last point already written
+        if state["last_point"] is not None:
+            track = np.vstack((state["last_point"], track))
+        state["last_point"] = track[-1]
+
+    buffer = {column: np.concatenate((state["buffer"][column], fixes[column])) for column in gps.FIX_COLUMNS}
+
+    # Latest fix that starts a valid window which is not turning and a pair which is not stationary
+    window_end, delta, turning = gps.turning_windows(buffer)
+    stationary = gps.stationary_pairs(buffer)
+    count = min(len(turning), len(stationary))
+    candidates = np.flatnonzero(~turning[:count] & ~stationary[:count])
+    cut = int(candidates[-1]) if len(candidates) else 0
+
+    turns = gps.check_turns(buffer)
+    stops = gps.check_stop(buffer)
+    if cut:
+        if state["open_stop"] is not None:
+            # The open stop ended before the cut
+            stops = close_open_stop(state, buffer, stops)
+        cut_time = buffer["time"][cut]
+        turns = {column: turns[column][turns["start"] < cut_time] for column in gps.TURN_COLUMNS}
+        stops = {column: stops[column][stops["start"] < cut_time] for column in gps.STOP_COLUMNS}
+        buffer = {column: buffer[column][cut:] for column in gps.FIX_COLUMNS}
+    else:
+        turns = {column: turns[column][:0] for column in gps.TURN_COLUMNS}
+        stops = {column: stops[column][:0] for column in gps.STOP_COLUMNS}
+
+    state["buffer"] = collapse_stop(state, buffer)
+    state["turns"] += len(turns["time"])
+    state["stops"] += len(stops["start"])
+
+    return {"track": track, "turns": turns, "stops": stops}
+
+def collapse_stop(state, buffer):
+    """
+       Drop the fixes of a stop in progress at the start of the buffer, keeping its start in the state and its
+       latest fix in the buffer. A pair of fixes is stationary on its own, so the latest fix is all the stop needs
+       to go on, and no window starting at a stationary fix is turning.
+
+       :param :
+        state: live trip state, updated in place
+        buffer: fixes after the cut
+
+       :return:
+        buffer: the buffer, or its latest fix when all of it after its first fix is stationary
+    """
+    stationary = gps.stationary_pairs(buffer)
+    if len(stationary) == 0 or not stationary[1:].all():
+        return buffer
+
+    if stationary[0]:
+        # The whole buffer is stopped, a stop already open goes on
+        first = 0
+    elif state["open_stop"] is None and len(stationary) >= 2 and not gps.turning_windows(buffer)[2][:1].all():
+        # The first fix starts a final window which is not turning, as the cut does
+        first = 1
+    else:
+        return buffer
+    if state["open_stop"] is None:
+        state["open_stop"] = {"start": buffer["time"][first], "lat": buffer["lat"][first],
+                              "lon": buffer["lon"][first]}
+
+    return {column: buffer[column][-1:] for column in gps.FIX_COLUMNS}
+
+def close_open_stop(state, buffer, stops):
+    """
+       Replace the part of the open stop found at the start of the buffer with the whole stop
+
+       :param :
+        state: live trip state, updated in place
+        buffer: fixes whose first fix is the latest fix of the open stop
+        stops: stops found in the buffer
+
+       :return:
+        stops: stops with the whole open stop first when it lasts longer than gps.STOP_TIME
+    """
+    open_stop = state["open_stop"]
+    state["open_stop"] = None
+    time = buffer["time"]
+    # The stop goes on until the first pair which is not stationary
+    moving = np.flatnonzero(~gps.stationary_pairs(buffer))
+    end = int(moving[0]) if len(moving) else len(time) - 1
+
+    rest = stops["start"] != time[0]
+    duration = np.round(time[end] - open_stop["start"], 3)
+    if duration <= gps.STOP_TIME:
+        return {column: stops[column][rest] for column in gps.STOP_COLUMNS}
+
+    whole = {"start": open_stop["start"], "end": time[end], "duration": duration, "lat": open_stop["lat"],
+             "lon": open_stop["lon"]}
+
+    return {column: np.concatenate(([whole[column]], stops[column][rest])) for column in gps.STOP_COLUMNS}
+
+def finish_live_state(state):
+    """
+       Finalize a trailing sentence without a newline and the turns and stops still in the buffer at the end of a
+       live trip
+
+       :param :
+        state: live trip state
+
+       :return:
+        update: dictionary with the track points of the trailing sentence and the remaining turns and stops
+    """
+    track = np.empty((0, 2))
+    final = {"turns": [], "stops": []}
+    if state["partial"]:
+        update = feed_bytes(state, b"\n")
+        track = update["track"]
+        final["turns"].append(update["turns"])
+        final["stops"].append(update["stops"])
+
+    buffer = state["buffer"]
+    turns = gps.check_turns(buffer)
+    stops = gps.check_stop(buffer)
+    if state["open_stop"] is not None:
+        stops = close_open_stop(state, buffer, stops)
+    final["turns"].append(turns)
+    final["stops"].append(stops)
+    state["buffer"] = empty_trip()
+    state["turns"] += len(turns["time"])
+    state["stops"] += len(stops["start"])
+
+    return {"track": track,
+            "turns": {column: np.concatenate([part[column] for part in final["turns"]])
+                      for column in gps.TURN_COLUMNS},
+            "stops": {column: np.concatenate([part[column] for part in final["stops"]])
+                      for column in gps.STOP_COLUMNS}}
+
+def open_live_kml(file_name):
+    """
+       Start a kml that stays a complete document while it grows
+
+       :param :
+        file_name: file name of kml file to be written
+
+       :return:
+        writer: dictionary holding the open file and the position of its trailer
+    """
+    file = gps.write_kmlfile_header(file_name)
+    writer = {"file": file, "pos": file.tell()}
+    file.write(gps.KML_TRAILER)
+    file.flush()
+
+    return writer
+
+def append_live_kml(writer, update):
+    """
+       Write new track points and placemarks in place of the trailer, then restore the trailer
+
+       :param :
+        writer: live kml writer
+        update: update from feed_fixes or finish_live_state
+
+       :return:
+        None
+    """
+    if len(update["track"]) < 2 and not len(update["turns"]["time"]) and not len(update["stops"]["start"]):
+        return
+    file = writer["file"]
+    file.seek(writer["pos"])
+    file.truncate()
+    if len(update["track"]) >= 2:
+        gps.write_kmlfile_body(file, gps.simplify_directions(update["track"]))
+    gps.write_kmlfile_body_turn(file, update["turns"])
+    gps.write_kmlfile_body_stop(file, update["stops"])
+    writer["pos"] = file.tell()
+    file.write(gps.KML_TRAILER)
+    file.flush()
+
+def follow(file, poll_interval=1.0, idle_timeout=None):
+    """
+       Follow a growing NMEA log until it stays idle for idle_timeout seconds or the user interrupts
+
+       :param :
+        file: NMEA txt file to be followed
+        poll_interval: seconds to wait before checking the log for new bytes
+        idle_timeout: idle seconds after which to stop, None to follow until interrupted
+
+       :return:
+        state: final live trip state
+    """
+    state = new_live_state()
+    writer = open_live_kml(file)
+    idle = 0.0
+
+    with open(file, "rb") as f:
+        try:
+            while True:
+                chunk = f.read(TAIL_READ_SIZE)
+                if chunk:
+                    idle = 0.0
+                    append_live_kml(writer, feed_bytes(state, chunk))
+                    print("Fixes " + str(state["fixes"]) + " turns " + str(state["turns"]) + " stops " +
+                          str(state["stops"]) + " cost " + str(live_cost(state)))
+                    continue
+                if idle_timeout is not None and idle >= idle_timeout:
+                    break
+                time.sleep(poll_interval)
+                idle += poll_interval
+        except KeyboardInterrupt:
+            pass
+
+    append_live_kml(writer, finish_live_state(state))
+    writer["file"].close()
+
+    return state
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""
+Author: Amol Gaikwad
+
+Level of detail kml output for long trips. The bounding box of the track is split into a quadtree of tiles. Every
+level halves the tile size and the simplification tolerance, so a tile always holds about one point per pixel at
+its display size. Each tile is a small kml with a Region, and it links to its child tiles with NetworkLinks, so
+the viewer only fetches the detail visible at the current zoom. Turns, stops and driving events are few and are
+written to the root document.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import os
+import sys
+import math
+import shutil
+import numpy as np
+import PROJ01_Gaikwad_Amol_GPSVisualization as gps
+
+# Display size of a tile in pixels, the tolerance of a level is the tile size divided by it
+LOD_TILE_PIXELS = 256
+# Projected tile size in pixels at which a tile appears, and at which it is replaced by its children
+LOD_MIN_PIXELS = 128
+LOD_MAX_PIXELS = 512
+# Maximum number of levels
+LOD_MAX_LEVELS = 12
+
+def main():
+    """
+        Main Program
+        Handle command line arguments.
+
+        :param : Command line arguments
+        :argv[1]: NMEA txt file
+        :argv[2]: Optional number of levels, chosen from the size of the trip by default
+
+        :return: None
+    """
+    # Read number of arguments
+    noofargs = len(sys.argv)
+
+    # Check for invalid number of arguments
+    if noofargs < 2 or noofargs > 3:
+        print("Invalid number of arguments")
+        return
+
+    data = gps.load_trip(sys.argv[1])
+    levels = int(sys.argv[2]) if noofargs == 3 else None
+    tiles = write_lod_kml(sys.argv[1], data, levels)
+    print("Written "+str(tiles)+" tiles")
+
+def lod_levels(points):
+    """
+       Number of levels needed for the finest tiles to be simplified with gps.SIMPLIFY_TOLERANCE
+
+       :param :
+        points: float64 array of shape (n, 2) in metres
+
+       :return:
+        levels: number of levels
+    """
+    span = float((points.max(axis=0) - points.min(axis=0)).max()) if len(points) else 0.0
+    finest = gps.SIMPLIFY_TOLERANCE * LOD_TILE_PIXELS
+    if span <= finest:
+        return 1
+
+    return min(int(math.ceil(math.log2(span / finest))) + 1, LOD_MAX_LEVELS)
+
+def track_bounds(directions):
+    """
+       Bounding box of a track, padded so that it never has zero size
+
+       :param :
+        directions: float64 array of shape (n, 2) holding latitude and longitude
+
+       :return:
+        bounds: south, west, north and east in decimal degrees
+    """
+    south, west = directions.min(axis=0) - 1e-6
+    north, east = directions.max(axis=0) + 1e-6
+
+    return float(south), float(west), float(north), float(east)
+
+def tile_bounds(bounds, level, x, y):
+    """
+       Bounding box of a tile
+
+       :param :
+        bounds: bounding box of the track from track_bounds
+        level: level of the tile, with 2**level tiles along each side
+        x: column of the tile from the west
+        y: row of the tile from the south
+
+       :return:
+        bounds: south, west, north and east of the tile in decimal degrees
+    """
+    south, west, north, east = bounds
+    height = (north - south) / 2 ** level
+    width = (east - west) / 2 ** level
+
+    return south + y * height, west + x * width, south + (y + 1) * height, west + (x + 1) * width
+
+def tile_pieces(directions, bounds, level):
+    """
+       Split a simplified track into the tiles of one level. Every segment belongs to the tile of its first point,
+       and runs of consecutive segments in the same tile form one piece, so neighbouring tiles join up without gaps.
+
+       :param :
+        directions: simplified float64 array of shape (n, 2) holding latitude and longitude
+        bounds: bounding box of the track from track_bounds
+        level: level of the tiles
+
+       :return:
+        tiles: dictionary of (x, y) to a list of float64 arrays of shape (m, 2), one per piece
+    """
+    tiles = {}
+    if len(directions) < 2:
+        return tiles
+
+    south, west, north, east = bounds
+    side = 2 ** level
+    x = np.clip(((directions[:, 1] - west) / (east - west) * side).astype(np.int64), 0, side - 1)
+    y = np.clip(((directions[:, 0] - south) / (north - south) * side).astype(np.int64), 0, side - 1)
+    tile = x * side + y
+
+    # Segments grouped by tile, in track order within each tile
+    segment_tile = tile[:-1]
+    order = np.argsort(segment_tile, kind="stable")
+    # New piece wherever the tile changes or the segments are not consecutive
+    breaks = np.flatnonzero((np.diff(segment_tile[order]) != 0) | (np.diff(order) != 1)) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(order)]))
+
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        first = int(order[start])
+        last = int(order[end - 1])
+        key = divmod(int(segment_tile[first]), side)
+        tiles.setdefault(key, []).append(directions[first:last + 2])
+
+    return tiles
+
+def region_kml(bounds, min_pixels, max_pixels):
+    """
+       Region element for a bounding box
+
+       :param :
+        bounds: south, west, north and east in decimal degrees
+        min_pixels: projected size in pixels at which the region becomes active
+        max_pixels: projected size in pixels at which the region stops being active, -1 for never
+
+       :return:
+        region: kml string
+    """
+    south, west, north, east = bounds
+
+    return ("<Region><LatLonAltBox><north>"+repr(north)+"</north><south>"+repr(south)+"</south><east>"+repr(east)+
+            "</east><west>"+repr(west)+"</west></LatLonAltBox><Lod><minLodPixels>"+str(min_pixels)+
+            "</minLodPixels><maxLodPixels>"+str(max_pixels)+"</maxLodPixels></Lod></Region>\n")
+
+def network_link_kml(bounds, href, min_pixels=LOD_MIN_PIXELS):
+    """
+       NetworkLink element that loads a tile once its region becomes active
+
+       :param :
+        bounds: bounding box of the linked tile
+        href: path of the linked tile kml
+        min_pixels: projected size in pixels at which the tile is loaded
+
+       :return:
+        link: kml string
+    """
+    return ("<NetworkLink>"+region_kml(bounds, min_pixels, -1)+"<Link><href>"+href+
+            "</href><viewRefreshMode>onRegion</viewRefreshMode></Link></NetworkLink>\n")
+
+def tile_name(level, x, y):
+    """
+       File name of a tile kml
+
+       :param :
+        level: level of the tile
+        x: column of the tile
+        y: row of the tile
+
+       :return:
+        name: file name
+    """
+    return str(level)+"_"+str(x)+"_"+str(y)+".kml"
+
+def write_tile(path, bounds, level, pieces, children):
+    """
+       Emit the kml of one tile
+
+       :param :
+        path: path of the tile kml
+        bounds: bounding box of the tile
+        level: level of the tile
+        pieces: list of float64 arrays of shape (m, 2) holding latitude and longitude
+        children: list of (bounds, file name) of the child tiles holding track pieces
+
+       :return:
+        None
+    """
+    # Top level is always visible, leaves stay visible however close the view gets
+    min_pixels = 0 if level == 0 else LOD_MIN_PIXELS
+    max_pixels = LOD_MAX_PIXELS if children else -1
+
+    with open(path, "w", encoding="utf-8", buffering=gps.KML_BUFFER_SIZE) as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns = "http://www.opengis.net/kml/2.2">\n'
+                   '<Document>\n')
+        # Document stays active so its links keep loading, only the track gives way to the children
+        file.write(region_kml(bounds, min_pixels, -1))
+        if pieces:
+            file.write("<Placemark>"+region_kml(bounds, min_pixels, max_pixels)+
+                       "<Style><LineStyle><color>Af00ffff</color><width>6</width></LineStyle></Style>"
+                       "<MultiGeometry>\n")
+            for piece in pieces:
+                file.write("<LineString><tessellate>1</tessellate><coordinates>")
+                file.write(" ".join([repr(lon)+","+repr(lat) for lat, lon in piece.tolist()]))
+                file.write("</coordinates></LineString>\n")
+            file.write("</MultiGeometry></Placemark>\n")
+        for child_bounds, child_name in children:
+            file.write(network_link_kml(child_bounds, child_name))
+        file.write("</Document>\n</kml>\n")
+
+def write_lod_kml(file_name, data, levels=None):
+    """
+       Emit a root kml and a directory of tile kmls for a trip
+
+       :param :
+        file_name: file name of the trip, the root is written next to it as <name>_lod.kml with its tiles in
+                   <name>_lod/
+        data: trip containing one array per column in gps.FIX_COLUMNS
+        levels: number of levels, None to choose from the size of the trip
+
+       :return:
+        tiles: number of tile kmls written
+    """
+    base_name = os.path.splitext(file_name)[0]+"_lod"
+    tile_dir = base_name
+    # Tiles of an earlier run may no longer be linked
+    shutil.rmtree(tile_dir, ignore_errors=True)
+    os.makedirs(tile_dir)
+
+    directions = gps.process_directions(data)
+    if levels is None:
+        levels = lod_levels(gps.local_metres(directions))
+    bounds = track_bounds(directions) if len(directions) else (0.0, 0.0, 1e-6, 1e-6)
+
+    # Pieces of every level, the finest level uses gps.SIMPLIFY_TOLERANCE and each coarser one doubles it
+    level_tiles = [tile_pieces(gps.simplify_directions(directions, gps.SIMPLIFY_TOLERANCE * 2 ** (levels-1-level)),
+                               bounds, level) for level in range(levels)]
+    # Coarser simplification may leave a tile empty while its children are not, keep it so they stay linked
+    for level in range(levels - 1, 0, -1):
+        for x, y in list(level_tiles[level]):
+            level_tiles[level-1].setdefault((x // 2, y // 2), [])
+
+    tiles = 0
+    for level, pieces in enumerate(level_tiles):
+        for (x, y), tile in pieces.items():
+            children = []
+            if level + 1 < levels:
+                for child_x in (2 * x, 2 * x + 1):
+                    for child_y in (2 * y, 2 * y + 1):
+                        if (child_x, child_y) in level_tiles[level+1]:
+                            children.append((tile_bounds(bounds, level+1, child_x, child_y),
+                                             tile_name(level+1, child_x, child_y)))
+            write_tile(os.path.join(tile_dir, tile_name(level, x, y)), tile_bounds(bounds, level, x, y), level,
+                       tile, children)
+            tiles += 1
+
+    # Root document links the top tile and holds the placemarks
+    file = gps.write_kmlfile_header(base_name)
+    if level_tiles and (0, 0) in level_tiles[0]:
+        file.write(network_link_kml(bounds, os.path.basename(tile_dir)+"/"+tile_name(0, 0, 0), 0))
+    gps.write_kmlfile_body_turn(file, gps.check_turns(data))
+    gps.write_kmlfile_body_stop(file, gps.check_stop(data))
+    gps.write_kmlfile_body_events(file, gps.check_events(data))
+    gps.write_kmlfile_trailer(file)
+
+    return tiles
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Author: Amol Gaikwad
+
+Trip similarity search. Every trip is resampled to a fixed number of points evenly spaced along its path, and
+trips are compared with dynamic time warping restricted to a Sakoe-Chiba band. Candidates are pruned with two
+lower bounds of the banded distance: the distance of the query to the bounding box of a trip, then the distance
+to its band envelope. Only the survivors are warped, many trips at a time.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import os
+import sys
+import math
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import PROJ01_Gaikwad_Amol_GPSVisualization as gps
+
+# Number of points every trip is resampled to
+RESAMPLE_POINTS = 128
+# Half width of the Sakoe-Chiba band as a fraction of the resampled length
+BAND_FRACTION = 0.1
+# Number of candidates warped at a time
+DTW_BATCH = 256
+# Default number of similar trips to report
+TOP_TRIPS = 5
+
+def main():
+    """
+        Main Program
+        Handle command line arguments.
+
+        :param : Command line arguments
+        :argv[1]: NMEA txt file of the query trip
+        :argv[2]: Optional directory or glob pattern of NMEA txt files to search
+        :argv[3]: Optional number of similar trips to report
+
+        :return: None
+    """
+    # Read number of arguments
+    noofargs = len(sys.argv)
+
+    # Check for invalid number of arguments
+    if noofargs < 2 or noofargs > 4:
+        print("Invalid number of arguments")
+        return
+
+    files = gps.find_trip_files(sys.argv[2] if noofargs >= 3 else ".")
+    top = int(sys.argv[3]) if noofargs == 4 else TOP_TRIPS
+
+    query = resample_trip(sys.argv[1])
+    if query is None:
+        print("Query trip has no valid fixes")
+        return
+    # Leave the query itself out of the search
+    files = [file for file in files if os.path.abspath(file) != os.path.abspath(sys.argv[1])]
+    files, tracks = route_library(files)
+
+    for distance, file in similar_trips(query, tracks, files, top):
+        print(file+" mean distance "+str(round(distance, 1))+" m cost "+str(gps.score_trip(file, gps.CACHE_DIR)))
+
+def resample_trip(file, points=RESAMPLE_POINTS, cache_dir=gps.CACHE_DIR):
+    """
+       Resample the track of a trip to points evenly spaced along its path
+
+       :param :
+        file: NMEA txt file
+        points: number of points
+        cache_dir: directory of the parsed trip cache, None to always parse
+
+       :return:
+        track: float64 array of shape (points, 2) holding latitude and longitude, None for a trip without fixes
+    """
+    directions = gps.process_directions(gps.load_trip(file, cache_dir))
+    if len(directions) == 0:
+        return None
+
+    lat = directions[:, 0]
+    lon = directions[:, 1]
+    travelled = np.concatenate(([0.0], np.cumsum(gps.haversine_distance(lat[:-1], lon[:-1], lat[1:], lon[1:]))))
+    # Drop points that do not move along the path so that it is strictly increasing
+    moving = np.concatenate(([True], np.diff(travelled) > 0))
+    travelled = travelled[moving]
+    at = np.linspace(0.0, travelled[-1], points)
+
+    return np.column_stack((np.interp(at, travelled, lat[moving]), np.interp(at, travelled, lon[moving])))
+
+def route_library(files, workers=None, cache_dir=gps.CACHE_DIR):
+    """
+       Resample trips in a process pool
+
+       :param :
+        files: NMEA txt files
+        workers: number of worker processes, defaults to the CPU count
+        cache_dir: directory of the parsed trip cache, None to always parse
+
+       :return:
+        files: files of the trips with valid fixes
+        tracks: float64 array of shape (len(files), RESAMPLE_POINTS, 2) holding latitude and longitude
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        tracks = list(executor.map(functools.partial(resample_trip, cache_dir=cache_dir), files, chunksize=16))
+
+    found = [idx for idx, track in enumerate(tracks) if track is not None]
+    if not found:
+        return [], np.empty((0, RESAMPLE_POINTS, 2))
+
+    return [files[idx] for idx in found], np.stack([tracks[idx] for idx in found])
+
+def project(tracks, lat0):
+    """
+       Project latitude and longitude onto a plane in metres around a fixed latitude, so that every trip shares
+       the same frame
+
+       :param :
+        tracks: float64 array of shape (..., 2) holding latitude and longitude
+        lat0: latitude of the projection in decimal degrees
+
+       :return:
+        points: float64 array of the same shape holding x (east) and y (north) in metres
+    """
+    scale = gps.EARTH_RADIUS_KM * 1000 * math.pi / 180
+    points = np.empty_like(tracks)
+    points[..., 0] = tracks[..., 1] * (scale * math.cos(math.radians(lat0)))
+    points[..., 1] = tracks[..., 0] * scale
+
+    return points
+
+def box_distance(points, low, high):
+    """
+       Distance of points to axis aligned boxes
+
+       :param :
+        points: float64 array of shape (..., 2)
+        low: lower corners of the boxes, broadcastable against points
+        high: upper corners of the boxes, broadcastable against points
+
+       :return:
+        distance: float64 array of distances, 0 inside a box
+    """
+    outside = np.maximum(np.maximum(low - points, points - high), 0)
+
+    return np.sqrt(np.einsum("...k,...k->...", outside, outside))
+
+def bbox_bound(query, candidates):
+    """
+       Lower bound of the warping distance from the bounding box of every candidate. Every query point is matched
+       to some candidate point, which is never closer than the bounding box.
+
+       :param :
+        query: float64 array of shape (n, 2) in metres
+        candidates: float64 array of shape (count, n, 2) in metres
+
+       :return:
+        bound: float64 array of shape (count,)
+    """
+    low = candidates.min(axis=1)[:, None, :]
+    high = candidates.max(axis=1)[:, None, :]
+
+    return box_distance(query[None, :, :], low, high).sum(axis=1)
+
+def envelope_bound(query, candidates, band):
+    """
+       Lower bound of the banded warping distance from the envelope of every candidate. Query point i can only be
+       matched to candidate points i-band to i+band, which are never closer than their bounding box.
+
+       :param :
+        query: float64 array of shape (n, 2) in metres
+        candidates: float64 array of shape (count, n, 2) in metres
+        band: half width of the band in points
+
+       :return:
+        bound: float64 array of shape (count,)
+    """
+    padded = np.pad(candidates, ((0, 0), (band, band), (0, 0)), mode="edge")
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * band + 1, axis=1)
+
+    return box_distance(query[None, :, :], windows.min(axis=3), windows.max(axis=3)).sum(axis=1)
+
+def banded_dtw(query, candidates, band):
+    """
+       Dynamic time warping distance between a query and many candidates of the same length, restricted to a
+       Sakoe-Chiba band. Rows of the cost matrix are filled one at a time for all candidates at once. Within a row
+       D[i, j] = min(T[j], d[i, j] + D[i, j-1]) with T[j] = d[i, j] + min(D[i-1, j-1], D[i-1, j]), which unrolls
+       into the running minimum S[j] + min(T[k] - S[k] for k <= j) with S the cumulative sum of d[i].
+
+       :param :
+        query: float64 array of shape (n, 2) in metres
+        candidates: float64 array of shape (count, n, 2) in metres
+        band: half width of the band in points
+
+       :return:
+        distance: float64 array of shape (count,) holding the sum of matched point distances
+    """
+    count, length = candidates.shape[:2]
+    # Column j+1 of a row holds D[i, j], column 0 the cell before the first point
+    previous = np.full((count, length + 1), np.inf)
+    previous[:, 0] = 0.0
+
+    for row in range(length):
+        low = max(0, row - band)
+        high = min(length, row + band + 1)
+        diff = candidates[:, low:high] - query[row]
+        cost = np.sqrt(np.einsum("ijk,ijk->ij", diff, diff))
+
+        step = cost + np.minimum(previous[:, low:high], previous[:, low+1:high+1])
+        total = np.cumsum(cost, axis=1)
+        current = np.full((count, length + 1), np.inf)
+        current[:, low+1:high+1] = total + np.minimum.accumulate(step - total, axis=1)
+        previous = current
+
+    return previous[:, length]
+
+def similar_trips(query, tracks, files, top=TOP_TRIPS, band_fraction=BAND_FRACTION):
+    """
+       Most similar trips to a query. Candidates are visited in order of their bounding box bound and warped a batch
+       at a time, skipping those whose envelope bound already exceeds the current top distances. The search stops
+       once the bounding box bound of the next candidate does.
+
+       :param :
+        query: float64 array of shape (n, 2) holding latitude and longitude
+        tracks: float64 array of shape (count, n, 2) holding latitude and longitude
+        files: files of the tracks
+        top: number of trips to return
+        band_fraction: half width of the band as a fraction of n
+
+       :return:
+        ranking: list of (mean distance in metres, file) from most to least similar
+    """
+    length = len(query)
+    band = max(1, int(math.ceil(band_fraction * length)))
+    lat0 = float(query[:, 0].mean())
+    query = project(query, lat0)
+    candidates = project(tracks, lat0)
+
+    bound = bbox_bound(query, candidates)
+    order = np.argsort(bound, kind="stable")
+    best = np.empty(0)
+    best_idx = np.empty(0, dtype=np.int64)
+
+    for start in range(0, len(order), DTW_BATCH):
+        limit = best[-1] if len(best) == top else np.inf
+        batch = order[start:start+DTW_BATCH]
+        batch = batch[bound[batch] < limit]
+        if len(batch) == 0:
+            # Remaining candidates have a larger bound still
+            break
+        batch = batch[envelope_bound(query, candidates[batch], band) < limit]
+        distance = banded_dtw(query, candidates[batch], band)
+
+        # Keep the top distances seen so far
+        best = np.concatenate((best, distance))
+        best_idx = np.concatenate((best_idx, batch))
+        keep = np.argsort(best, kind="stable")[:top]
+        best = best[keep]
+        best_idx = best_idx[keep]
+
+    return [(float(distance) / length, files[idx]) for distance, idx in zip(best, best_idx.tolist())]
+
+if __name__ == '__main__':
+    main()
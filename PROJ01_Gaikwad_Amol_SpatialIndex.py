@@ -0,0 +1,433 @@
+"""
+Author: Amol Gaikwad
+
+Persistent spatial grid index over the fixes and stops of every GPS trip. Points are bucketed into a uniform
+lat/lon grid and stored in segments sorted by cell key, so radius and bounding box queries only binary search the
+cells they overlap. Adding a log writes one new segment per layer instead of rebuilding the index.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import os
+import sys
+import json
+import math
+import shutil
+import numpy as np
+import PROJ01_Gaikwad_Amol_GPSVisualization as gps
+
+# Layers of indexed points
+LAYERS = ("fixes", "stops")
+# Columns stored for every indexed point: cell key, trip id, row within the trip layer, position and epoch seconds
+INDEX_COLUMNS = ("key", "trip", "row", "lat", "lon", "time")
+# Default grid cell size in degrees, about 55 m of latitude
+CELL_SIZE = 0.0005
+
+def main():
+    """
+        Main Program
+        Handle command line arguments.
+
+        :param : Command line arguments
+        :argv[1]: Index directory
+        :argv[2]: Command, one of add, near, bbox or compact
+        :argv[3:]: add <directory or glob> | near <lat> <lon> <radius m> [fixes|stops] |
+                   bbox <south> <west> <north> <east> [fixes|stops] | compact
+
+        :return: None
+    """
+    # Read number of arguments
+    noofargs = len(sys.argv)
+
+    if noofargs < 3:
+        print("Invalid number of arguments")
+        return
+
+    index_dir = sys.argv[1]
+    command = sys.argv[2]
+
+    if command == "add" and noofargs == 4:
+        added = update_index(index_dir, gps.find_trip_files(sys.argv[3]))
+        print("Indexed "+str(len(added))+" new or changed trips")
+    elif command == "near" and noofargs in (6, 7):
+        layer = sys.argv[6] if noofargs == 7 else "fixes"
+        result = query_radius(index_dir, float(sys.argv[3]), float(sys.argv[4]), float(sys.argv[5]), layer)
+        show_result(index_dir, result)
+    elif command == "bbox" and noofargs in (7, 8):
+        layer = sys.argv[7] if noofargs == 8 else "fixes"
+        result = query_bbox(index_dir, float(sys.argv[3]), float(sys.argv[4]), float(sys.argv[5]),
+                            float(sys.argv[6]), layer)
+        show_result(index_dir, result)
+    elif command == "compact" and noofargs == 3:
+        compact_index(index_dir)
+    else:
+        print("Invalid arguments")
+
+def show_result(index_dir, result):
+    """
+       Print the trips hit by a query and the number of points in each
+
+       :param :
+        index_dir: index directory
+        result: query result
+
+       :return:
+        None
+    """
+    paths = trip_paths(index_dir)
+    trip_ids, counts = np.unique(result["trip"], return_counts=True)
+    for trip_id, count in zip(trip_ids.tolist(), counts.tolist()):
+        print(paths[trip_id]+" "+str(count)+" points")
+
+def cell_keys(lat, lon, cell_size):
+    """
+       Grid cell key of every point. Keys increase by longitude within a row of latitude, so the cells of one row
+       of a bounding box are a contiguous key range.
+
+       :param :
+        lat: latitudes in decimal degrees
+        lon: longitudes in decimal degrees
+        cell_size: grid cell size in degrees
+
+       :return:
+        keys: int64 cell keys
+    """
+    ncols = math.ceil(360 / cell_size)
+    row = np.floor((np.asarray(lat) + 90) / cell_size).astype(np.int64)
+    col = np.floor((np.asarray(lon) + 180) / cell_size).astype(np.int64)
+    np.clip(col, 0, ncols - 1, out=col)
+
+    return row * ncols + col
+
+def read_meta(index_dir):
+    """
+       Read the index metadata, creating an empty index if none exists
+
+       :param :
+        index_dir: index directory
+
+       :return:
+        meta: index metadata
+    """
+    try:
+        with open(os.path.join(index_dir, "index.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"cell_size": CELL_SIZE, "next_trip": 0, "next_segment": 0, "trips": {}, "segments": []}
+
+def write_meta(index_dir, meta):
+    """
+       Atomically write the index metadata
+
+       :param :
+        index_dir: index directory
+        meta: index metadata
+
+       :return:
+        None
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_file = os.path.join(index_dir, "index.json.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, os.path.join(index_dir, "index.json"))
+
+def trip_paths(index_dir):
+    """
+       Source path of every indexed trip
+
+       :param :
+        index_dir: index directory
+
+       :return:
+        paths: dictionary of trip id to source path
+    """
+    return {trip["id"]: path for path, trip in read_meta(index_dir)["trips"].items()}
+
+def write_segment(index_dir, meta, layer, points):
+    """
+       Sort points by cell key and write them as a new segment
+
+       :param :
+        index_dir: index directory
+        meta: index metadata, updated in place
+        layer: layer of the points
+        points: dictionary of arrays keyed by INDEX_COLUMNS
+
+       :return:
+        None
+    """
+    order = np.argsort(points["key"], kind="stable")
+    name = "seg_"+str(meta["next_segment"])
+    meta["next_segment"] += 1
+    os.makedirs(os.path.join(index_dir, name), exist_ok=True)
+    for column in INDEX_COLUMNS:
+        np.save(os.path.join(index_dir, name, column+".npy"), points[column][order])
+    meta["segments"].append({"name": name, "layer": layer, "trips": sorted(set(points["trip"].tolist())),
+                             "size": len(order)})
+
+def read_segment(index_dir, segment):
+    """
+       Memory map the columns of a segment
+
+       :param :
+        index_dir: index directory
+        segment: segment metadata
+
+       :return:
+        points: dictionary of memory mapped arrays keyed by INDEX_COLUMNS
+    """
+    return {column: np.load(os.path.join(index_dir, segment["name"], column+".npy"), mmap_mode="r")
+            for column in INDEX_COLUMNS}
+
+def drop_trips(index_dir, meta, trip_ids):
+    """
+       Remove trips from every segment holding them. Replaced segments are left on disk, to be deleted once the
+       metadata no longer points at them.
+
+       :param :
+        index_dir: index directory
+        meta: index metadata, updated in place
+        trip_ids: set of trip ids to be removed
+
+       :return:
+        dropped: list of the metadata of the replaced segments
+    """
+    segments = meta["segments"]
+    meta["segments"] = []
+    dropped = []
+    for segment in segments:
+        if trip_ids.isdisjoint(segment["trips"]):
+            meta["segments"].append(segment)
+            continue
+        points = read_segment(index_dir, segment)
+        keep = ~np.isin(points["trip"], list(trip_ids))
+        if keep.any():
+            write_segment(index_dir, meta, segment["layer"], {column: points[column][keep]
+                                                                for column in INDEX_COLUMNS})
+        dropped.append(segment)
+
+    return dropped
+
+def trip_points(data, trip_id, cell_size):
+    """
+       Indexed points of every layer of a trip
+
+       :param :
+        data: trip containing one array per column in gps.FIX_COLUMNS
+        trip_id: id of the trip
+        cell_size: grid cell size in degrees
+
+       :return:
+        layers: dictionary of layer to points keyed by INDEX_COLUMNS
+    """
+    stops = gps.check_stop(data) if len(data["time"]) > 1 else {column: np.empty(0)
+                                                                  for column in gps.STOP_COLUMNS}
+    layers = {}
+    for layer, lat, lon, time in (("fixes", data["lat"], data["lon"], data["time"]),
+                                  ("stops", stops["lat"], stops["lon"], stops["start"])):
+        layers[layer] = {"key": cell_keys(lat, lon, cell_size),
+                         "trip": np.full(len(lat), trip_id, dtype=np.int32),
+                         "row": np.arange(len(lat), dtype=np.int64),
+                         "lat": np.asarray(lat, dtype=np.float64), "lon": np.asarray(lon, dtype=np.float64),
+                         "time": np.asarray(time, dtype=np.float64)}
+
+    return layers
+
+def update_index(index_dir, files, cache_dir=gps.CACHE_DIR):
+    """
+       Add new logs to the index and re-index logs whose size or mtime changed. Every added trip gets one new
+       segment per layer; existing segments are only rewritten when they hold a changed trip.
+
+       :param :
+        index_dir: index directory
+        files: NMEA txt files to be indexed
+        cache_dir: directory of the parsed trip cache, None to always parse
+
+       :return:
+        added: list of files indexed by this call
+    """
+    meta = read_meta(index_dir)
+    cell_size = meta["cell_size"]
+    added = []
+    stale = set()
+
+    for file in files:
+        path = os.path.abspath(file)
+        stat = os.stat(path)
+        trip = meta["trips"].get(path)
+        if trip is not None:
+            if (trip["size"], trip["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            stale.add(trip["id"])
+            trip_id = trip["id"]
+        else:
+            trip_id = meta["next_trip"]
+            meta["next_trip"] += 1
+        meta["trips"][path] = {"id": trip_id, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        added.append(file)
+
+    dropped = drop_trips(index_dir, meta, stale) if stale else []
+
+    for file in added:
+        path = os.path.abspath(file)
+        data = gps.load_trip(file, cache_dir)
+        for layer, points in trip_points(data, meta["trips"][path]["id"], cell_size).items():
+            if len(points["key"]):
+                write_segment(index_dir, meta, layer, points)
+
+    write_meta(index_dir, meta)
+
+    for segment in dropped:
+        shutil.rmtree(os.path.join(index_dir, segment["name"]))
+
+    return added
+
+def compact_index(index_dir):
+    """
+       Merge all segments of each layer into a single segment
+
+       :param :
+        index_dir: index directory
+
+       :return:
+        None
+    """
+    meta = read_meta(index_dir)
+    segments = meta["segments"]
+    meta["segments"] = []
+    for layer in LAYERS:
+        parts = [read_segment(index_dir, segment) for segment in segments if segment["layer"] == layer]
+        if parts:
+            write_segment(index_dir, meta, layer, {column: np.concatenate([part[column] for part in parts])
+                                                   for column in INDEX_COLUMNS})
+    write_meta(index_dir, meta)
+
+    for segment in segments:
+        shutil.rmtree(os.path.join(index_dir, segment["name"]))
+
+def query_cells(index_dir, south, west, north, east, layer):
+    """
+       Points of a layer in the grid cells overlapping a bounding box
+
+       :param :
+        index_dir: index directory
+        south: southern latitude in decimal degrees
+        west: western longitude in decimal degrees
+        north: northern latitude in decimal degrees
+        east: eastern longitude in decimal degrees, less than west for a box crossing the antimeridian
+        layer: one of LAYERS
+
+       :return:
+        result: dictionary of arrays keyed by INDEX_COLUMNS
+    """
+    if south > north:
+        raise ValueError("Bounding box south edge "+str(south)+" is north of its north edge "+str(north))
+    if west > east:
+        # A box crossing the antimeridian is its parts on either side
+        parts = [query_cells(index_dir, south, west, north, 180.0, layer),
+                 query_cells(index_dir, south, -180.0, north, east, layer)]
+        return {column: np.concatenate([part[column] for part in parts]) for column in INDEX_COLUMNS}
+
+    meta = read_meta(index_dir)
+    cell_size = meta["cell_size"]
+    ncols = math.ceil(360 / cell_size)
+    first, last = cell_keys([south, north], [west, east], cell_size)
+    rows = np.arange(first // ncols, last // ncols + 1, dtype=np.int64) * ncols
+    # Every row of the box is one contiguous key range
+    row_start = rows + first % ncols
+    row_end = rows + last % ncols
+
+    parts = []
+    for segment in meta["segments"]:
+        if segment["layer"] != layer:
+            continue
+        points = read_segment(index_dir, segment)
+        lo = np.searchsorted(points["key"], row_start, side="left")
+        hi = np.searchsorted(points["key"], row_end, side="right")
+        lengths = hi - lo
+        if not lengths.any():
+            continue
+        # Concatenate the index ranges of all rows without a Python loop
+        idx = np.repeat(lo - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        parts.append({column: points[column][idx] for column in INDEX_COLUMNS})
+
+    if not parts:
+        return {column: np.empty(0, dtype=np.int32 if column == "trip" else np.float64)
+                for column in INDEX_COLUMNS}
+
+    return {column: np.concatenate([part[column] for part in parts]) for column in INDEX_COLUMNS}
+
+def query_bbox(index_dir, south, west, north, east, layer="fixes"):
+    """
+       Points of a layer inside a bounding box
+
+       :param :
+        index_dir: index directory
+        south: southern latitude in decimal degrees
+        west: western longitude in decimal degrees
+        north: northern latitude in decimal degrees
+        east: eastern longitude in decimal degrees, less than west for a box crossing the antimeridian
+        layer: one of LAYERS
+
+       :return:
+        result: dictionary of arrays keyed by INDEX_COLUMNS
+    """
+    result = query_cells(index_dir, south, west, north, east, layer)
+    if west <= east:
+        inside_lon = (result["lon"] >= west) & (result["lon"] <= east)
+    else:
+        inside_lon = (result["lon"] >= west) | (result["lon"] <= east)
+    inside = (result["lat"] >= south) & (result["lat"] <= north) & inside_lon
+
+    return {column: result[column][inside] for column in INDEX_COLUMNS}
+
+def query_radius(index_dir, lat, lon, radius, layer="fixes"):
+    """
+       Points of a layer within a radius of a location
+
+       :param :
+        index_dir: index directory
+        lat: latitude in decimal degrees
+        lon: longitude in decimal degrees
+        radius: radius in metres
+        layer: one of LAYERS
+
+       :return:
+        result: dictionary of arrays keyed by INDEX_COLUMNS
+    """
+    dlat = math.degrees(radius / (gps.EARTH_RADIUS_KM * 1000))
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-12)
+    if dlon >= 180:
+        west, east = -180.0, 180.0
+    else:
+        # Wrap the box around the antimeridian
+        west = (lon - dlon + 180) % 360 - 180
+        east = (lon + dlon + 180) % 360 - 180
+    result = query_cells(index_dir, lat - dlat, west, lat + dlat, east, layer)
+    dist = gps.haversine_distance(lat, lon, result["lat"], result["lon"]) * 1000
+    inside = dist <= radius
+
+    return {column: result[column][inside] for column in INDEX_COLUMNS}
+
+def trips_near(index_dir, lat, lon, radius, layer="fixes"):
+    """
+       Source paths of the trips with a point of a layer within a radius of a location
+
+       :param :
+        index_dir: index directory
+        lat: latitude in decimal degrees
+        lon: longitude in decimal degrees
+        radius: radius in metres
+        layer: one of LAYERS
+
+       :return:
+        paths: sorted list of source paths
+    """
+    paths = trip_paths(index_dir)
+    trip_ids = np.unique(query_radius(index_dir, lat, lon, radius, layer)["trip"])
+
+    return sorted(paths[trip_id] for trip_id in trip_ids.tolist())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Author: Amol Gaikwad
+
+Recurring stop discovery across trips. The stops of every trip are clustered with DBSCAN, using a uniform grid of
+eps sized cells so that the neighbours of a point are only searched in its own and the 8 adjacent cells. Clusters
+are reported as stop sites, such as traffic lights and depots, with their visit counts and dwell time distribution.
+
+"""
+__author__ = 'Amol Gaikwad'
+
+import sys
+import numpy as np
+import PROJ01_Gaikwad_Amol_GPSVisualization as gps
+
+# Neighbourhood radius in metres and minimum number of stops within it for a core stop
+SITE_EPS = 25.0
+SITE_MIN_STOPS = 3
+# Percentiles of dwell time reported for every site
+DWELL_PERCENTILES = (10, 50, 90)
+# Number of points of a cell compared with its candidates at a time, bounding memory in dense cells
+NEIGHBOUR_BLOCK = 1024
+
+def main():
+    """
+        Main Program
+        Handle command line arguments.
+
+        :param : Command line arguments
+        :argv[1]: Optional directory or glob pattern of NMEA txt files
+        :argv[2]: Optional neighbourhood radius in metres
+        :argv[3]: Optional minimum number of stops of a site
+
+        :return: None
+    """
+    # Read number of arguments
+    noofargs = len(sys.argv)
+
+    if noofargs > 4:
+        print("Invalid number of arguments")
+        return
+
+    files = gps.find_trip_files(sys.argv[1] if noofargs >= 2 else ".")
+    eps = float(sys.argv[2]) if noofargs >= 3 else SITE_EPS
+    min_stops = int(sys.argv[3]) if noofargs == 4 else SITE_MIN_STOPS
+
+    stops = collect_stops(files)
+    print("Total number of stops "+str(len(stops["lat"]))+"\n")
+    sites = find_stop_sites(stops, eps, min_stops)
+    show_sites(sites)
+    write_sites_kml("stop_sites", sites)
+
+def collect_stops(files, cache_dir=gps.CACHE_DIR):
+    """
+       Stops of every trip
+
+       :param :
+        files: NMEA txt files
+        cache_dir: directory of the parsed trip cache, None to always parse
+
+       :return:
+        stops: dictionary of arrays holding gps.STOP_COLUMNS and the index of the trip in files
+    """
+    parts = []
+    for trip, file in enumerate(files):
+        data = gps.load_trip(file, cache_dir)
+        if len(data["time"]) < 2:
+            continue
+        stops = gps.check_stop(data)
+        stops["trip"] = np.full(len(stops["start"]), trip, dtype=np.int32)
+        parts.append(stops)
+
+    columns = gps.STOP_COLUMNS + ("trip",)
+    if not parts:
+        return {column: np.empty(0, dtype=np.int32 if column == "trip" else np.float64) for column in columns}
+
+    return {column: np.concatenate([part[column] for part in parts]) for column in columns}
+
+def grid_neighbours(points, eps):
+    """
+       All pairs of points closer than eps, searching only the 3x3 block of grid cells around each point
+
+       :param :
+        points: float64 array of shape (n, 2) in metres
+        eps: neighbourhood radius in metres
+
+       :return:
+        first: indices of the first point of every pair
+        second: indices of the second point of every pair, each unordered pair appears once
+    """
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    cells = np.floor(points / eps).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    # Pack cells into sortable keys, leaving room for the neighbours of the edge cells
+    span = int(cells[:, 1].max()) + 2
+    keys, cell_of = np.unique(cells[:, 0] * span + cells[:, 1], return_inverse=True)
+    # Points grouped by cell
+    order = np.argsort(cell_of, kind="stable")
+    bounds = np.searchsorted(cell_of[order], np.arange(len(keys) + 1))
+    # Neighbour cells with a key not smaller than the cell itself, so each pair of cells is visited once
+    offsets = np.array([0, 1, span - 1, span, span + 1])
+
+    first = []
+    second = []
+    for cell in range(len(keys)):
+        found = np.minimum(np.searchsorted(keys, keys[cell] + offsets), len(keys) - 1)
+        found = found[keys[found] == keys[cell] + offsets]
+        # Own cell comes first among the candidates
+        candidates = np.concatenate([order[bounds[other]:bounds[other+1]] for other in found])
+        own = bounds[cell+1] - bounds[cell]
+        for block in range(0, own, NEIGHBOUR_BLOCK):
+            members = candidates[block:min(block+NEIGHBOUR_BLOCK, own)]
+            diff = points[members][:, None, :] - points[candidates][None, :, :]
+            close = np.einsum("ijk,ijk->ij", diff, diff) <= eps * eps
+            pair_first, pair_second = np.nonzero(close)
+            # Within the own cell keep each unordered pair once, with other cells keep every pair
+            keep = (pair_second >= own) | (pair_first + block < pair_second)
+            first.append(members[pair_first[keep]])
+            second.append(candidates[pair_second[keep]])
+
+    return np.concatenate(first), np.concatenate(second)
+
+def connected_labels(count, first, second):
+    """
+       Connected components of a graph by min-label hooking and pointer jumping
+
+       :param :
+        count: number of nodes
+        first: first node of every edge
+        second: second node of every edge
+
+       :return:
+        labels: smallest node index of the component of every node
+    """
+    labels = np.arange(count)
+    while True:
+        previous = labels.copy()
+        # Hook both ends of every edge to the smaller label
+        smaller = np.minimum(labels[first], labels[second])
+        np.minimum.at(labels, first, smaller)
+        np.minimum.at(labels, second, smaller)
+        # Jump pointers until every node points at a root
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, previous):
+            return labels
+
+def dbscan(points, eps, min_samples):
+    """
+       DBSCAN clustering using a grid of eps sized cells for the neighbour search
+
+       :param :
+        points: float64 array of shape (n, 2) in metres
+        eps: neighbourhood radius in metres
+        min_samples: minimum number of points within eps, itself included, of a core point
+
+       :return:
+        cluster: cluster number of every point, -1 for noise
+    """
+    count = len(points)
+    first, second = grid_neighbours(points, eps)
+    neighbours = np.bincount(first, minlength=count) + np.bincount(second, minlength=count) + 1
+    core = neighbours >= min_samples
+
+    # Clusters are the connected components of core points
+    core_edge = core[first] & core[second]
+    labels = connected_labels(count, first[core_edge], second[core_edge])
+    cluster = np.where(core, labels, -1)
+
+    # Border points join the cluster of a neighbouring core point
+    for border, core_point in ((first, second), (second, first)):
+        attach = ~core[border] & core[core_point]
+        cluster[border[attach]] = labels[core_point[attach]]
+
+    # Renumber clusters from 0
+    found = cluster >= 0
+    cluster[found] = np.unique(cluster[found], return_inverse=True)[1].ravel()
+
+    return cluster
+
+def find_stop_sites(stops, eps=SITE_EPS, min_stops=SITE_MIN_STOPS):
+    """
+       Cluster stops into recurring stop sites
+
+       :param :
+        stops: stops from collect_stops
+        eps: neighbourhood radius in metres
+        min_stops: minimum number of stops within eps of a core stop
+
+       :return:
+        sites: list of dictionaries describing each site, most visited first
+    """
+    if len(stops["lat"]) == 0:
+        return []
+
+    points = gps.local_metres(np.column_stack((stops["lat"], stops["lon"])))
+    cluster = dbscan(points, eps, min_stops)
+
+    sites = []
+    found = np.flatnonzero(cluster >= 0)
+    order = found[np.argsort(cluster[found], kind="stable")]
+    bounds = np.flatnonzero(np.diff(cluster[order], prepend=-2, append=-1))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        members = order[start:end]
+        dwell = stops["duration"][members]
+        sites.append({"lat": float(stops["lat"][members].mean()), "lon": float(stops["lon"][members].mean()),
+                      "visits": len(members), "trips": len(np.unique(stops["trip"][members])),
+                      "total_dwell": float(dwell.sum()), "mean_dwell": float(dwell.mean()),
+                      "max_dwell": float(dwell.max()),
+                      "dwell_percentiles": dict(zip(DWELL_PERCENTILES,
+                                                    np.percentile(dwell, DWELL_PERCENTILES).tolist()))})
+
+    sites.sort(key=lambda site: (-site["visits"], -site["total_dwell"]))
+
+    return sites
+
+def show_sites(sites):
+    """
+       Displays all recurring stop sites
+
+       :param :
+        sites: sites from find_stop_sites
+
+       :return:
+        None
+    """
+    for site in sites:
+        print("***** Stop site *******")
+        print("Location " + str(round(site["lat"], 6)) + ", " + str(round(site["lon"], 6)))
+        print("Visits " + str(site["visits"]) + " from " + str(site["trips"]) + " trips")
+        print("Mean dwell time " + str(round(site["mean_dwell"], 2)) + " secs, maximum " +
+              str(round(site["max_dwell"], 2)) + " secs")
+        print("Dwell time percentiles " + ", ".join("p" + str(key) + " " + str(round(value, 2)) + " secs"
+                                                    for key, value in site["dwell_percentiles"].items()))
+        print("***** End of stop site *******\n")
+
+def write_sites_kml(file_name, sites):
+    """
+       Emit a kml with one placemark per stop site
+
+       :param :
+        file_name: file name of kml file to be written
+        sites: sites from find_stop_sites
+
+       :return:
+        None
+    """
+    file = gps.write_kmlfile_header(file_name)
+    for site in sites:
+        gps.write_kml_placemark(file, site["lat"], site["lon"], "Stop site with " + str(site["visits"]) +
+                                " visits, median dwell " + str(round(site["dwell_percentiles"][50], 2)) + " secs",
+                                "stopPlacemark")
+    gps.write_kmlfile_trailer(file)
+
+if __name__ == '__main__':
+    main()